@@ -0,0 +1,84 @@
+from django.conf import settings
+from django.db import connection, models, transaction
+from django.db.models import Max, Min
+from django.utils import timezone
+from orders.models import Order, OrderItem
+
+
+class DailyMenuItemSalesManager(models.Manager):
+    WATERMARK = 'daily_menu_item_sales'
+
+    roll_up_sql = """
+        INSERT INTO {table} (day, menu_item_id, quantity, revenue, order_count)
+        SELECT (orders.created_at AT TIME ZONE %s)::date, line.menu_item_id,
+               SUM(line.quantity), COALESCE(SUM(line.line_total), 0), COUNT(DISTINCT orders.id)
+        FROM {order_table} AS orders
+        JOIN {item_table} AS line ON line.order_id = orders.id
+        WHERE orders.id > %s AND orders.id <= %s
+        GROUP BY 1, 2
+        ON CONFLICT (day, menu_item_id) DO UPDATE SET
+            quantity = {table}.quantity + EXCLUDED.quantity,
+            revenue = {table}.revenue + EXCLUDED.revenue,
+            order_count = {table}.order_count + EXCLUDED.order_count
+    """
+
+    def roll_up(self, batch_size, settle):
+        """Add orders placed since the watermark to the daily rollups and return the last order id rolled up.
+
+        Orders are taken in id ranges of ``batch_size``; each range is added and the watermark moved
+        in one transaction, so an interrupted run neither loses nor double counts orders. The run stops
+        short of the oldest order placed in the last ``settle``, so neither it nor a checkout still
+        committing with a lower id is skipped; imported orders with old ``created_at`` but higher ids
+        wait behind it too.
+        """
+        # only orders past the watermark are scanned, walking the primary key instead of every created_at
+        rolled_up = RollupWatermark.objects.filter(name=self.WATERMARK).values_list('last_order_id', flat=True)
+        first_recent = Order.objects.filter(
+            id__gt=rolled_up.first() or 0, created_at__gt=timezone.now() - settle,
+        ).aggregate(first=Min('id'))['first']
+        if first_recent is not None:
+            bound = first_recent - 1
+        else:
+            bound = Order.objects.aggregate(bound=Max('id'))['bound']
+        sql = self.roll_up_sql.format(table=self.model._meta.db_table, order_table=Order._meta.db_table,
+                                      item_table=OrderItem._meta.db_table)
+        while True:
+            with transaction.atomic():
+                watermark, _ = RollupWatermark.objects.select_for_update().get_or_create(name=self.WATERMARK)
+                start = watermark.last_order_id
+                if bound is None or start >= bound:
+                    return start
+                end = min(start + batch_size, bound)
+                with connection.cursor() as cursor:
+                    cursor.execute(sql, [settings.TIME_ZONE, start, end])
+                watermark.last_order_id = end
+                watermark.save(update_fields=['last_order_id', 'updated_at'])
+
+
+class DailyMenuItemSales(models.Model):
+    """Per day and menu item totals of order lines, kept up to date by the 'roll-up-sales' beat task.
+
+    Days are in ``TIME_ZONE`` and follow the order's ``created_at``.
+    """
+    day = models.DateField()
+    menu_item = models.ForeignKey('restaurant.MenuItem', on_delete=models.CASCADE)
+    quantity = models.PositiveBigIntegerField(default=0)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    order_count = models.PositiveIntegerField(default=0)
+
+    objects = DailyMenuItemSalesManager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['day', 'menu_item'], name='dailysales_day_menu_item_uniq'),
+        ]
+
+
+class RollupWatermark(models.Model):
+    """Id of the last order included in a rollup."""
+    name = models.CharField(max_length=64, unique=True)
+    last_order_id = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return self.name
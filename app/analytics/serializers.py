@@ -0,0 +1,24 @@
+from rest_framework import serializers
+
+
+class SalesReportQuerySerializer(serializers.Serializer):
+    GROUP_BY_CHOICES = ('menu_item', 'day')
+
+    start = serializers.DateField()
+    end = serializers.DateField()
+    menu_item = serializers.IntegerField(required=False)
+    group_by = serializers.ChoiceField(choices=GROUP_BY_CHOICES, default='menu_item')
+
+    def validate(self, data):
+        if data['start'] > data['end']:
+            raise serializers.ValidationError("start must not be after end.")
+        return data
+
+
+class SalesReportRowSerializer(serializers.Serializer):
+    day = serializers.DateField(required=False)
+    menu_item_id = serializers.IntegerField()
+    menu_item_name = serializers.CharField()
+    quantity = serializers.IntegerField()
+    revenue = serializers.DecimalField(max_digits=14, decimal_places=2)
+    order_count = serializers.IntegerField()
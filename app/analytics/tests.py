@@ -0,0 +1,121 @@
+import io
+import json
+import tempfile
+from datetime import datetime
+from decimal import Decimal
+from zoneinfo import ZoneInfo
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from rest_framework import status
+from rest_framework.test import APITestCase
+from app.tasks import roll_up_sales
+from orders.models import Order, OrderItem
+from restaurant.models import MenuItem
+from .models import DailyMenuItemSales, RollupWatermark
+
+
+class SalesRollupTests(APITestCase):
+
+    def setUp(self):
+        User = get_user_model()
+        self.user = User.objects.create_user(email='testuser@example.com', password='testpassword')
+        self.staff = User.objects.create_user(email='staff@example.com', password='testpassword', is_staff=True)
+        self.pizza = MenuItem.objects.create(name='Pizza', description='Pizza', price=Decimal('10.00'))
+        self.soup = MenuItem.objects.create(name='Soup', description='Soup', price=Decimal('4.00'))
+
+    def place_order(self, day, lines, hour=12):
+        created_at = datetime(2024, 3, day, hour, tzinfo=ZoneInfo(settings.TIME_ZONE))
+        order = Order.objects.create(user=self.user, total_price=0, delivery_time=created_at,
+                                     delivery_address='Test Address')
+        Order.objects.filter(id=order.id).update(created_at=created_at)
+        OrderItem.objects.bulk_create([
+            OrderItem(order=order, menu_item=menu_item, quantity=quantity, unit_price=menu_item.price,
+                      line_total=menu_item.price * quantity)
+            for menu_item, quantity in lines
+        ])
+        return order
+
+    def rollup(self, day, menu_item):
+        return DailyMenuItemSales.objects.values_list('quantity', 'revenue', 'order_count').get(
+            day=datetime(2024, 3, day).date(), menu_item=menu_item)
+
+    def test_rollup_is_incremental(self):
+        self.place_order(1, [(self.pizza, 2), (self.soup, 1)])
+        self.place_order(1, [(self.pizza, 1)])
+        roll_up_sales()
+        self.assertEqual(self.rollup(1, self.pizza), (3, Decimal('30.00'), 2))
+
+        last = self.place_order(1, [(self.pizza, 1)])
+        self.place_order(2, [(self.soup, 3)])
+        self.assertEqual(roll_up_sales(), last.id + 1)
+        self.assertEqual(roll_up_sales(), last.id + 1)
+        self.assertEqual(self.rollup(1, self.pizza), (4, Decimal('40.00'), 3))
+        self.assertEqual(self.rollup(1, self.soup), (1, Decimal('4.00'), 1))
+        self.assertEqual(self.rollup(2, self.soup), (3, Decimal('12.00'), 1))
+
+    def test_days_follow_local_time(self):
+        self.place_order(1, [(self.pizza, 1)], hour=1)
+        roll_up_sales()
+        self.assertEqual(self.rollup(1, self.pizza), (1, Decimal('10.00'), 1))
+
+    def test_recent_orders_wait_for_next_run(self):
+        self.place_order(1, [(self.pizza, 1)])
+        recent = Order.objects.create(user=self.user, total_price=0, delivery_time=self.pizza.created_at,
+                                      delivery_address='Test Address')
+        OrderItem.objects.create(order=recent, menu_item=self.pizza, quantity=1, line_total=Decimal('10.00'))
+        roll_up_sales()
+        self.assertEqual(RollupWatermark.objects.get().last_order_id, recent.id - 1)
+        self.assertEqual(list(DailyMenuItemSales.objects.values_list('quantity', flat=True)), [1])
+
+    def test_imported_orders_do_not_skip_recent_ones(self):
+        self.place_order(1, [(self.pizza, 1)])
+        recent = Order.objects.create(user=self.user, total_price=0, delivery_time=self.pizza.created_at,
+                                      delivery_address='Test Address')
+        OrderItem.objects.create(order=recent, menu_item=self.pizza, quantity=1, line_total=Decimal('10.00'))
+        with tempfile.NamedTemporaryFile('w', suffix='.ndjson') as file:
+            file.write(json.dumps({
+                'user_id': self.user.id, 'created_at': '2024-03-02T12:00:00+02:00',
+                'delivery_time': '2024-03-02T13:00:00+02:00', 'delivery_address': 'Old',
+                'items': [{'menu_item_id': self.soup.id, 'quantity': 2, 'unit_price': '4.00'}],
+            }) + '\n')
+            file.flush()
+            call_command('import_orders', file.name, stdout=io.StringIO())
+
+        roll_up_sales()
+        self.assertEqual(RollupWatermark.objects.get().last_order_id, recent.id - 1)
+
+        settled = datetime(2024, 3, 1, 13, tzinfo=ZoneInfo(settings.TIME_ZONE))
+        Order.objects.filter(id=recent.id).update(created_at=settled)
+        roll_up_sales()
+        self.assertEqual(self.rollup(1, self.pizza), (2, Decimal('20.00'), 2))
+        self.assertEqual(self.rollup(2, self.soup), (2, Decimal('8.00'), 1))
+
+    def test_sales_report(self):
+        self.place_order(1, [(self.pizza, 2), (self.soup, 1)])
+        self.place_order(2, [(self.pizza, 1)])
+        self.place_order(5, [(self.pizza, 7)])
+        roll_up_sales()
+        self.client.force_authenticate(user=self.staff)
+
+        response = self.client.get('/api/analytics/sales/?start=2024-03-01&end=2024-03-02')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIsNotNone(response.data['rolled_up_at'])
+        self.assertEqual([(row['menu_item_name'], row['quantity'], row['revenue'], row['order_count'])
+                          for row in response.data['results']],
+                         [('Pizza', 3, '30.00', 2), ('Soup', 1, '4.00', 1)])
+
+        response = self.client.get(
+            f'/api/analytics/sales/?start=2024-03-01&end=2024-03-31&group_by=day&menu_item={self.pizza.id}')
+        self.assertEqual([(row['day'], row['quantity']) for row in response.data['results']],
+                         [('2024-03-01', 2), ('2024-03-02', 1), ('2024-03-05', 7)])
+
+    def test_sales_report_validation_and_permissions(self):
+        self.client.force_authenticate(user=self.user)
+        response = self.client.get('/api/analytics/sales/?start=2024-03-01&end=2024-03-02')
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+        self.client.force_authenticate(user=self.staff)
+        response = self.client.get('/api/analytics/sales/?start=2024-03-05&end=2024-03-01')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
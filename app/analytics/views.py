@@ -0,0 +1,40 @@
+from django.db.models import F, Sum
+from drf_spectacular.utils import extend_schema
+from rest_framework import permissions, status
+from rest_framework.response import Response
+from rest_framework.views import APIView
+from .models import DailyMenuItemSales, DailyMenuItemSalesManager, RollupWatermark
+from .serializers import SalesReportQuerySerializer, SalesReportRowSerializer
+
+
+class SalesReportView(APIView):
+    permission_classes = [permissions.IsAdminUser]
+
+    @extend_schema(
+        summary="Sales per menu item",
+        description="Quantity, revenue and order count per menu item (or per day and menu item) for the "
+                    "inclusive date range, read from the daily rollups. Orders placed after `rolled_up_at` "
+                    "are not included yet.",
+        parameters=[SalesReportQuerySerializer],
+        responses=SalesReportRowSerializer(many=True),
+    )
+    def get(self, request):
+        query = SalesReportQuerySerializer(data=request.query_params)
+        if not query.is_valid():
+            return Response(query.errors, status=status.HTTP_400_BAD_REQUEST)
+        params = query.validated_data
+
+        rows = DailyMenuItemSales.objects.filter(day__range=(params['start'], params['end']))
+        if 'menu_item' in params:
+            rows = rows.filter(menu_item_id=params['menu_item'])
+        group_by = ['day', 'menu_item_id'] if params['group_by'] == 'day' else ['menu_item_id']
+        rows = (
+            rows.values(*group_by, menu_item_name=F('menu_item__name'))
+            .annotate(quantity=Sum('quantity'), revenue=Sum('revenue'), order_count=Sum('order_count'))
+            .order_by(*group_by)
+        )
+        watermark = RollupWatermark.objects.filter(name=DailyMenuItemSalesManager.WATERMARK).first()
+        return Response({
+            'rolled_up_at': watermark.updated_at if watermark else None,
+            'results': SalesReportRowSerializer(rows, many=True).data,
+        })
@@ -10,5 +10,24 @@ app.config_from_object('django.conf:settings', namespace='CELERY')
 app.autodiscover_tasks()
 
 app.conf.beat_schedule = {
-
+    'deliver-due-orders': {
+        'task': 'app.tasks.deliver_due_orders',
+        'schedule': 60.0,
+    },
+    'relay-order-events': {
+        'task': 'app.tasks.relay_order_events',
+        'schedule': 5.0,
+    },
+    'flush-carts': {
+        'task': 'app.tasks.flush_carts',
+        'schedule': 60.0,
+    },
+    'roll-up-sales': {
+        'task': 'app.tasks.roll_up_sales',
+        'schedule': 300.0,
+    },
+    'prune-expired-tokens': {
+        'task': 'app.tasks.prune_expired_tokens',
+        'schedule': 3600.0,
+    },
 }
@@ -0,0 +1,53 @@
+import json
+import smtplib
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.utils import timezone
+
+from .redis_client import get_redis
+
+DEAD_LETTER_KEY = 'notifications:dead'
+ORDER_DELIVERED_SUBJECT = "Your Order Has Been Delivered!"
+
+
+def order_delivered_message(user_email, user_first_name, order_id):
+    body = (f"Dear {user_first_name},\n\nYour order #{order_id} has been successfully delivered!"
+            f"\nThank you for choosing us.")
+    return EmailMessage(ORDER_DELIVERED_SUBJECT, body, settings.DEFAULT_FROM_EMAIL, [user_email])
+
+
+def send_batch(messages):
+    """Send ``messages`` over a single connection and return ``(message, error)`` for each failure.
+
+    One message failing does not stop the rest of the batch. If the connection cannot be
+    opened at all, every message is returned as failed.
+    """
+    failed = []
+    remaining = list(messages)
+    try:
+        with get_connection(fail_silently=False) as connection:
+            while remaining:
+                try:
+                    connection.send_messages([remaining[0]])
+                except (smtplib.SMTPException, OSError) as exc:
+                    failed.append((remaining[0], repr(exc)))
+                remaining.pop(0)
+    except (smtplib.SMTPException, OSError) as exc:
+        failed.extend((message, repr(exc)) for message in remaining)
+    return failed
+
+
+def dead_letter(failures):
+    if not failures:
+        return
+    now = timezone.now().isoformat()
+    get_redis().rpush(DEAD_LETTER_KEY, *[
+        json.dumps({'to': message.to, 'subject': message.subject, 'body': message.body,
+                    'error': error, 'failed_at': now})
+        for message, error in failures
+    ])
+
+
+def dead_letters(limit=100):
+    return [json.loads(entry) for entry in get_redis().lrange(DEAD_LETTER_KEY, 0, limit - 1)]
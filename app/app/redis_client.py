@@ -0,0 +1,288 @@
+import copy
+import fnmatch
+import queue
+import threading
+
+import redis
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_redis():
+    """Return the process-wide Redis client, or an in-process stand-in when running the tests."""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                if settings.REDIS_URL:
+                    _client = redis.Redis.from_url(settings.REDIS_URL, decode_responses=True)
+                elif settings.TESTING:
+                    _client = LocalRedis()
+                else:
+                    # a per-process stand-in would silently break everything shared between workers
+                    raise ImproperlyConfigured("Set REDIS_URL or REDIS_HOST.")
+    return _client
+
+
+class LocalPipeline:
+    def __init__(self, client):
+        self._client = client
+        self._commands = []
+        self._watched = None
+        self._watching = None
+
+    def __getattr__(self, name):
+        method = getattr(self._client, name)
+        if self._watched is not None:
+            return method
+
+        def queue(*args, **kwargs):
+            self._commands.append((method, args, kwargs))
+            return self
+
+        return queue
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.reset()
+
+    def _snapshot(self, names):
+        return {name: copy.deepcopy(self._client._data.get(name)) for name in names}
+
+    def watch(self, *names):
+        with self._client.lock:
+            self._watched = self._snapshot(names)
+
+    def multi(self):
+        self._commands = []
+        self._watching, self._watched = self._watched, None
+
+    def reset(self):
+        self._commands = []
+        self._watched = None
+        self._watching = None
+
+    def execute(self):
+        with self._client.lock:
+            if self._watching and self._snapshot(self._watching) != self._watching:
+                self.reset()
+                raise redis.WatchError("Watched variable changed.")
+            results = [method(*args, **kwargs) for method, args, kwargs in self._commands]
+        self.reset()
+        return results
+
+
+class LocalPubSub:
+    def __init__(self, client, ignore_subscribe_messages=False):
+        self._client = client
+        self._messages = queue.Queue()
+        self._ignore_subscribe_messages = ignore_subscribe_messages
+        self.channels = set()
+
+    def subscribe(self, *channels):
+        with self._client.lock:
+            self.channels.update(channels)
+            self._client._subscribers.add(self)
+        if not self._ignore_subscribe_messages:
+            for channel in channels:
+                self._messages.put({'type': 'subscribe', 'channel': channel, 'data': len(self.channels)})
+
+    def unsubscribe(self, *channels):
+        with self._client.lock:
+            self.channels.difference_update(channels or set(self.channels))
+
+    def close(self):
+        with self._client.lock:
+            self._client._subscribers.discard(self)
+
+    def get_message(self, timeout=0.0):
+        try:
+            return self._messages.get(timeout=timeout) if timeout else self._messages.get_nowait()
+        except queue.Empty:
+            return None
+
+    def listen(self):
+        while True:
+            yield self._messages.get()
+
+
+class LocalRedis:
+    """Thread-safe, in-memory subset of the Redis commands used by this project.
+
+    Used by the test suite; it is not shared between processes and ignores expiry.
+    """
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self._data = {}
+        self._subscribers = set()
+
+    def pipeline(self, transaction=True):
+        return LocalPipeline(self)
+
+    def pubsub(self, ignore_subscribe_messages=False):
+        return LocalPubSub(self, ignore_subscribe_messages)
+
+    def publish(self, channel, message):
+        with self.lock:
+            subscribers = [pubsub for pubsub in self._subscribers if channel in pubsub.channels]
+        for pubsub in subscribers:
+            pubsub._messages.put({'type': 'message', 'channel': channel, 'data': str(message)})
+        return len(subscribers)
+
+    def flushall(self):
+        with self.lock:
+            self._data.clear()
+
+    def exists(self, *names):
+        with self.lock:
+            return sum(1 for name in names if name in self._data)
+
+    def delete(self, *names):
+        with self.lock:
+            return sum(1 for name in names if self._data.pop(name, None) is not None)
+
+    def expire(self, name, time):
+        with self.lock:
+            return name in self._data
+
+    def keys(self, pattern='*'):
+        with self.lock:
+            return [name for name in self._data if fnmatch.fnmatchcase(name, pattern)]
+
+    def get(self, name):
+        with self.lock:
+            return self._data.get(name)
+
+    def mget(self, *names):
+        with self.lock:
+            return [self._data.get(name) for name in names]
+
+    def set(self, name, value, ex=None, nx=False):
+        with self.lock:
+            if nx and name in self._data:
+                return None
+            self._data[name] = str(value)
+            return True
+
+    def incr(self, name, amount=1):
+        with self.lock:
+            value = int(self._data.get(name, 0)) + amount
+            self._data[name] = str(value)
+            return value
+
+    def hgetall(self, name):
+        with self.lock:
+            return dict(self._data.get(name, {}))
+
+    def hset(self, name, key=None, value=None, mapping=None):
+        with self.lock:
+            fields = self._data.setdefault(name, {})
+            items = dict(mapping or {})
+            if key is not None:
+                items[key] = value
+            added = sum(1 for field in items if field not in fields)
+            fields.update({field: str(field_value) for field, field_value in items.items()})
+            return added
+
+    def hincrby(self, name, key, amount=1):
+        with self.lock:
+            fields = self._data.setdefault(name, {})
+            value = int(fields.get(key, 0)) + amount
+            fields[key] = str(value)
+            return value
+
+    def hdel(self, name, *keys):
+        with self.lock:
+            fields = self._data.get(name, {})
+            return sum(1 for key in keys if fields.pop(key, None) is not None)
+
+    def sadd(self, name, *values):
+        with self.lock:
+            members = self._data.setdefault(name, set())
+            added = sum(1 for value in values if str(value) not in members)
+            members.update(str(value) for value in values)
+            return added
+
+    def srem(self, name, *values):
+        with self.lock:
+            members = self._data.get(name, set())
+            removed = sum(1 for value in values if str(value) in members)
+            members.difference_update(str(value) for value in values)
+            return removed
+
+    def smembers(self, name):
+        with self.lock:
+            return set(self._data.get(name, set()))
+
+    def sismember(self, name, value):
+        with self.lock:
+            return str(value) in self._data.get(name, set())
+
+    def sscan_iter(self, name, match=None, count=None):
+        return iter(self.smembers(name))
+
+    def spop(self, name, count=None):
+        with self.lock:
+            members = self._data.get(name, set())
+            popped = [members.pop() for _ in range(min(count or 1, len(members)))]
+            if count is None:
+                return popped[0] if popped else None
+            return popped
+
+    def rpush(self, name, *values):
+        with self.lock:
+            items = self._data.setdefault(name, [])
+            items.extend(str(value) for value in values)
+            return len(items)
+
+    def lrange(self, name, start, end):
+        with self.lock:
+            items = self._data.get(name, [])
+            return list(items[start:None if end == -1 else end + 1])
+
+    def ltrim(self, name, start, end):
+        with self.lock:
+            if name in self._data:
+                self._data[name] = self.lrange(name, start, end)
+            return True
+
+    def llen(self, name):
+        with self.lock:
+            return len(self._data.get(name, []))
+
+    def zadd(self, name, mapping):
+        with self.lock:
+            members = self._data.setdefault(name, {})
+            added = sum(1 for member in mapping if str(member) not in members)
+            members.update({str(member): float(score) for member, score in mapping.items()})
+            return added
+
+    def zrem(self, name, *values):
+        with self.lock:
+            members = self._data.get(name, {})
+            return sum(1 for value in values if members.pop(str(value), None) is not None)
+
+    def zcard(self, name):
+        with self.lock:
+            return len(self._data.get(name, {}))
+
+    def zrange(self, name, start, end, withscores=False):
+        with self.lock:
+            ranked = sorted(self._data.get(name, {}).items(), key=lambda item: (item[1], item[0]))
+            ranked = ranked[start:None if end == -1 else end + 1]
+            return ranked if withscores else [member for member, _ in ranked]
+
+    def zremrangebyscore(self, name, min, max):
+        with self.lock:
+            members = self._data.get(name, {})
+            low, high = float(min), float(max)
+            removed = [member for member, score in members.items() if low <= score <= high]
+            for member in removed:
+                del members[member]
+            return len(removed)
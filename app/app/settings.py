@@ -11,6 +11,7 @@ https://docs.djangoproject.com/en/5.1/ref/settings/
 """
 
 import os
+import sys
 from datetime import timedelta
 from pathlib import Path
 
@@ -37,11 +38,14 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
     'rest_framework',
+    'rest_framework_simplejwt.token_blacklist',
     'drf_spectacular',
     'users',
     'restaurant',
-    'orders'
+    'orders',
+    'analytics',
 ]
 
 MIDDLEWARE = [
@@ -88,6 +92,73 @@ DATABASES = {
     }
 }
 
+# Redis
+# Set REDIS_URL or REDIS_HOST; app.redis_client.get_redis() raises ImproperlyConfigured without one.
+# The test suite always uses the in-process stand-in from app.redis_client so it does not need a
+# Redis server.
+
+TESTING = sys.argv[1:2] == ['test']
+
+REDIS_HOST = os.environ.get('REDIS_HOST')
+REDIS_PORT = os.environ.get('REDIS_PORT', '6379')
+REDIS_URL = os.environ.get('REDIS_URL') or (f'redis://{REDIS_HOST}:{REDIS_PORT}/1' if REDIS_HOST else None)
+if TESTING:
+    REDIS_URL = None
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': REDIS_URL,
+    } if REDIS_URL else {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+}
+
+# Pre-rendered menu
+# Anonymous JSON requests for the menu list are answered from compressed bytes kept in the cache
+# by restaurant.menu_cache. MenuItem writes rebuild them with the 'rebuild_menu_cache' task;
+# MENU_CACHE_TIMEOUT (seconds) bounds how long an entry lives if a rebuild is lost.
+MENU_CACHE_TIMEOUT = 3600
+
+# Menu catalog
+# restaurant.catalog keeps a per-process snapshot of the menu for pricing and validation. MenuItem
+# writes announce a new version over Redis pub/sub; MENU_CATALOG_MAX_AGE (seconds) bounds how
+# stale a snapshot can get if an announcement is missed. While Redis is unreachable snapshots are
+# loaded from the database alone and kept for MENU_CATALOG_FALLBACK_MAX_AGE seconds.
+MENU_CATALOG_MAX_AGE = 300
+MENU_CATALOG_FALLBACK_MAX_AGE = 5
+
+# Cart storage
+# 'orders.cart_store.DatabaseCartStore' keeps carts in the orders.Cart table,
+# 'orders.cart_store.RedisCartStore' keeps active carts in Redis and writes them back at checkout
+# and from the periodic 'flush-carts' task, 'orders.cart_store.LocMemCartStore' is the in-process fake.
+
+CART_STORE = {
+    'BACKEND': os.environ.get('CART_STORE_BACKEND', 'orders.cart_store.DatabaseCartStore'),
+    'TTL': timedelta(days=7),
+    'FLUSH_BATCH_SIZE': 500,
+}
+
+# Delivery sweep
+# Orders due for delivery are marked delivered by the 'deliver-due-orders' beat task,
+# DELIVERY_SWEEP_BATCH_SIZE rows per UPDATE, and notified in groups of DELIVERY_NOTIFICATION_BATCH_SIZE.
+
+DELIVERY_SWEEP_BATCH_SIZE = 1000
+DELIVERY_NOTIFICATION_BATCH_SIZE = 100
+
+# Order events are written to the orders.OrderEvent outbox and published to Celery
+# by the 'relay-order-events' beat task, OUTBOX_RELAY_BATCH_SIZE events per message.
+# Events still unprocessed OUTBOX_REDELIVERY_TIMEOUT after publishing are published again.
+OUTBOX_RELAY_BATCH_SIZE = 500
+OUTBOX_REDELIVERY_TIMEOUT = timedelta(minutes=5)
+
+# Sales analytics
+# The 'roll-up-sales' beat task adds new orders to analytics.DailyMenuItemSales,
+# ANALYTICS_ROLLUP_BATCH_SIZE order ids per transaction. Orders younger than ANALYTICS_ROLLUP_SETTLE
+# wait for the next run so transactions still in flight are not skipped.
+ANALYTICS_ROLLUP_BATCH_SIZE = 10000
+ANALYTICS_ROLLUP_SETTLE = timedelta(minutes=1)
+
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
 AUTH_USER_MODEL = 'users.CustomUser'
@@ -107,16 +178,46 @@ AUTH_PASSWORD_VALIDATORS = [
 ]
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'users.authentication.StatelessJWTAuthentication',
     ),
     'DEFAULT_FILTER_BACKENDS': (
         'django_filters.rest_framework.DjangoFilterBackend',
     ),
     'DEFAULT_SCHEMA_CLASS': 'drf_spectacular.openapi.AutoSchema',
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
-    'PAGE_SIZE': '12'
+    'PAGE_SIZE': '12',
+    'DEFAULT_THROTTLE_RATES': {
+        'auth_ip': '20/min',
+        'auth_email': '5/min',
+    },
+    # proxies in front of gunicorn that append to X-Forwarded-For; throttles key on the address the
+    # outermost one saw, or on REMOTE_ADDR with 0, never on a client-supplied header
+    'NUM_PROXIES': int(os.environ.get('NUM_PROXIES', '0')),
 
 }
+# Authentication
+# users.authentication.StatelessJWTAuthentication builds request.user from the token claims and
+# falls back to a user record cached in Redis for USER_CACHE_TTL seconds once the user changed.
+USER_CACHE_TTL = 60
+
+# Refresh tokens are checked against the blacklist through users.blacklist: a per-process Bloom
+# filter sized for TOKEN_BLACKLIST_BLOOM_CAPACITY tokens and rebuilt every
+# TOKEN_BLACKLIST_BLOOM_MAX_AGE seconds, backed by a Redis set. The 'prune-expired-tokens' task
+# deletes expired tokens TOKEN_PRUNE_BATCH_SIZE rows at a time.
+TOKEN_BLACKLIST_BLOOM_CAPACITY = 1000000
+TOKEN_BLACKLIST_BLOOM_ERROR_RATE = 0.001
+TOKEN_BLACKLIST_BLOOM_MAX_AGE = 3600
+TOKEN_PRUNE_BATCH_SIZE = 5000
+
+# Login, token refresh and registration are throttled per IP ('auth_ip') and, except refresh, per
+# email ('auth_email') over sliding windows kept in Redis by users.throttling. At most
+# PASSWORD_HASHING_CONCURRENCY logins and registrations hash a password at once across all workers;
+# the rest get 429 with Retry-After PASSWORD_HASHING_RETRY_AFTER seconds. A slot held longer than
+# PASSWORD_HASHING_SLOT_TIMEOUT seconds is assumed abandoned.
+PASSWORD_HASHING_CONCURRENCY = 8
+PASSWORD_HASHING_RETRY_AFTER = 1
+PASSWORD_HASHING_SLOT_TIMEOUT = 30
+
 SIMPLE_JWT = {
     "ACCESS_TOKEN_LIFETIME": timedelta(minutes=560),
     "REFRESH_TOKEN_LIFETIME": timedelta(days=7),
@@ -149,10 +250,10 @@ SIMPLE_JWT = {
     "SLIDING_TOKEN_LIFETIME": timedelta(minutes=360),
     "SLIDING_TOKEN_REFRESH_LIFETIME": timedelta(days=1),
 
-    "TOKEN_OBTAIN_SERIALIZER": "rest_framework_simplejwt.serializers.TokenObtainPairSerializer",
-    "TOKEN_REFRESH_SERIALIZER": "rest_framework_simplejwt.serializers.TokenRefreshSerializer",
+    "TOKEN_OBTAIN_SERIALIZER": "users.serializers.ClaimsTokenObtainPairSerializer",
+    "TOKEN_REFRESH_SERIALIZER": "users.serializers.ClaimsTokenRefreshSerializer",
     "TOKEN_VERIFY_SERIALIZER": "rest_framework_simplejwt.serializers.TokenVerifySerializer",
-    "TOKEN_BLACKLIST_SERIALIZER": "rest_framework_simplejwt.serializers.TokenBlacklistSerializer",
+    "TOKEN_BLACKLIST_SERIALIZER": "users.serializers.CachedTokenBlacklistSerializer",
     "SLIDING_TOKEN_OBTAIN_SERIALIZER": "rest_framework_simplejwt.serializers.TokenObtainSlidingSerializer",
     "SLIDING_TOKEN_REFRESH_SERIALIZER": "rest_framework_simplejwt.serializers.TokenRefreshSlidingSerializer",
 }
@@ -187,13 +288,27 @@ STATICFILES_DIRS = [os.path.join(BASE_DIR, 'static')] if os.getenv('DEBUG', 'Tru
 STATIC_ROOT = os.path.join(BASE_DIR, 'staticfiles')
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
-EMAIL_BACKEND = 'django.core.mail.backends.smtp.EmailBackend'
+# Use 'django.core.mail.backends.filebased.EmailBackend' (with EMAIL_FILE_PATH) or
+# 'django.core.mail.backends.locmem.EmailBackend' to run the notification pipeline offline.
+EMAIL_BACKEND = os.environ.get('EMAIL_BACKEND', 'django.core.mail.backends.smtp.EmailBackend')
+EMAIL_FILE_PATH = os.environ.get('EMAIL_FILE_PATH', os.path.join(BASE_DIR, 'sent_emails'))
 EMAIL_HOST = 'smtp.ethereal.email'
 EMAIL_PORT = 587
 EMAIL_USE_TLS = True
 EMAIL_HOST_USER = os.environ.get('EMAIL_HOST_USER')
 EMAIL_HOST_PASSWORD = os.environ.get('EMAIL_HOST_PASSWORD')
 DEFAULT_FROM_EMAIL = EMAIL_HOST_USER
+
+# Notifications are sent in batches over one connection. A batch is retried up to
+# NOTIFICATION_MAX_RETRIES times (with NOTIFICATION_RETRY_DELAY seconds of backoff) for the messages
+# that failed, after which they are pushed to the dead-letter list in Redis.
+NOTIFICATION_MAX_RETRIES = 3
+NOTIFICATION_RETRY_DELAY = 30
+
+# Celery reads CELERY_BROKER_URL from the environment; the test suite queues tasks in memory so it
+# does not need a broker.
+if TESTING:
+    CELERY_BROKER_URL = 'memory://'
 # CELERY_IMPORTS = [
 #     'app.tasks',
 # ]
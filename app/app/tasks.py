@@ -1,18 +1,129 @@
 from celery import shared_task
-from django.core.mail import send_mail
 from django.conf import settings
-from orders.models import Order
+from django.db import transaction
+from django.utils import timezone
+from analytics.models import DailyMenuItemSales
+from app.notifications import dead_letter, order_delivered_message, send_batch
+from orders.cart_store import get_cart_store
+from orders.models import Order, OrderEvent
+from restaurant import menu_cache
+from users.blacklist import prune_expired_tokens as prune_tokens
 
 
 @shared_task
 def send_order_delivered_email(user_email, user_first_name, order_id):
+    # Kept for messages scheduled with an ETA before deliver_due_orders replaced them.
     try:
         order = Order.objects.get(id=order_id)
         order.is_delivered = True
         order.save(update_fields=["is_delivered"])
-        subject = "Your Order Has Been Delivered!"
-        message = (f"Dear {user_first_name},\n\nYour order #{order_id} has been successfully delivered!"
-                   f"\nThank you for choosing us.")
-        send_mail(subject, message, settings.DEFAULT_FROM_EMAIL, [user_email])
+        order_delivered_message(user_email, user_first_name, order_id).send()
     except Order.DoesNotExist:
         pass
+
+
+@shared_task(bind=True, max_retries=settings.NOTIFICATION_MAX_RETRIES)
+def send_order_delivered_emails(self, notifications):
+    """Send a batch of delivery emails over one connection.
+
+    Only the messages that failed are retried, with exponential backoff; once the retries are
+    used up they go to the dead-letter list.
+    """
+    batch = [(notification, order_delivered_message(*notification)) for notification in notifications]
+    failures = send_batch([message for _, message in batch])
+    if not failures:
+        return len(batch)
+
+    if self.request.retries < self.max_retries:
+        failed = {id(message) for message, _ in failures}
+        raise self.retry(args=[[notification for notification, message in batch if id(message) in failed]],
+                         countdown=settings.NOTIFICATION_RETRY_DELAY * 2 ** self.request.retries)
+    dead_letter(failures)
+    return len(batch) - len(failures)
+
+
+@shared_task
+def deliver_due_orders():
+    """Flip every due order to delivered in bulk; notifications go out through the outbox."""
+    now = timezone.now()
+    delivered = 0
+    while True:
+        order_ids = Order.objects.deliver_due(now, settings.DELIVERY_SWEEP_BATCH_SIZE)
+        delivered += len(order_ids)
+        if len(order_ids) < settings.DELIVERY_SWEEP_BATCH_SIZE:
+            return delivered
+
+
+@shared_task
+def relay_order_events():
+    """Publish unpublished outbox rows to ``process_order_events`` in batches.
+
+    A batch is only marked published if handing it to the broker succeeded, so events are
+    delivered at least once. Rows published more than ``OUTBOX_REDELIVERY_TIMEOUT`` ago and still
+    unprocessed are published again, in case the message was lost after the broker took it.
+    """
+    stale = timezone.now() - settings.OUTBOX_REDELIVERY_TIMEOUT
+    return (_relay(OrderEvent.objects.filter(published_at__isnull=True).order_by('id'))
+            + _relay(OrderEvent.objects.filter(processed_at__isnull=True, published_at__lt=stale)
+                     .order_by('published_at', 'id')))
+
+
+def _relay(events):
+    batch_size = settings.OUTBOX_RELAY_BATCH_SIZE
+    published = 0
+    while True:
+        with transaction.atomic():
+            event_ids = list(events.select_for_update(skip_locked=True).values_list('id', flat=True)[:batch_size])
+            if event_ids:
+                process_order_events.delay(event_ids)
+                OrderEvent.objects.filter(id__in=event_ids).update(published_at=timezone.now())
+        published += len(event_ids)
+        if len(event_ids) < batch_size:
+            return published
+
+
+@shared_task(acks_late=True)
+def process_order_events(event_ids):
+    """Handle outbox events; events already processed are skipped, so redelivery is safe.
+
+    The message is acknowledged only once the task has finished, so a worker that dies mid-batch
+    leaves it on the broker for another worker.
+
+    The row locks are waited for, not skipped: the relay still holds them until it commits, and
+    a concurrent redelivery holds them until its ``processed_at`` update is visible.
+    """
+    batch_size = settings.DELIVERY_NOTIFICATION_BATCH_SIZE
+    with transaction.atomic():
+        events = list(
+            OrderEvent.objects.select_for_update()
+            .filter(id__in=event_ids, processed_at__isnull=True)
+            .order_by('id')
+        )
+        notifications = [
+            [event.payload['email'], event.payload['first_name'], event.order_id]
+            for event in events if event.event_type == OrderEvent.ORDER_DELIVERED
+        ]
+        for start in range(0, len(notifications), batch_size):
+            send_order_delivered_emails.delay(notifications[start:start + batch_size])
+        OrderEvent.objects.filter(id__in=[event.id for event in events]).update(processed_at=timezone.now())
+    return len(events)
+
+
+@shared_task
+def flush_carts():
+    return get_cart_store().flush_dirty()
+
+
+@shared_task
+def roll_up_sales():
+    return DailyMenuItemSales.objects.roll_up(settings.ANALYTICS_ROLLUP_BATCH_SIZE, settings.ANALYTICS_ROLLUP_SETTLE)
+
+
+@shared_task
+def rebuild_menu_cache():
+    return menu_cache.rebuild()
+
+
+@shared_task
+def prune_expired_tokens():
+    return prune_tokens(settings.TOKEN_PRUNE_BATCH_SIZE)
@@ -11,6 +11,7 @@ urlpatterns = ([
                    path('api/schema/redoc/', SpectacularRedocView.as_view(url_name='schema'), name='redoc'),
                    path('api/user/', include('users.urls')),
                    path('api/restaurant/', include('restaurant.urls')),
+                   path('api/analytics/', include('analytics.urls')),
                    path('api/', include('orders.urls'))
                ] + static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT) +
                static(settings.STATIC_URL, document_root=settings.STATIC_ROOT))
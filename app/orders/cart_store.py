@@ -0,0 +1,235 @@
+from django.conf import settings
+from django.utils.dateparse import parse_datetime
+from django.utils.module_loading import import_string
+
+from redis import WatchError
+
+from app.redis_client import LocalRedis, get_redis
+from .models import Cart
+from .mutations import CartConflict
+
+_stores = {}
+
+
+def get_cart_store():
+    backend = settings.CART_STORE['BACKEND']
+    if backend not in _stores:
+        _stores[backend] = import_string(backend)()
+    return _stores[backend]
+
+
+class BaseCartStore:
+    def get_cart(self, user):
+        """Return a ``Cart`` whose ``items`` reflect the latest state of the user's cart."""
+        raise NotImplementedError
+
+    def apply(self, user, mutation, expected_version=None):
+        """Apply ``mutation`` and return the cart's new ``(version, items)``.
+
+        With ``expected_version`` the write only succeeds if the cart is still at that version,
+        otherwise ``CartConflict`` is raised.
+        """
+        raise NotImplementedError
+
+    def flush(self, user):
+        """Write the user's cart back to the ``Cart`` table and return what was written, if anything."""
+
+    def flush_dirty(self):
+        """Write back every cart changed since the last flush. Returns the number of carts written."""
+        return 0
+
+    def clear(self, user, flushed=None):
+        """Forget the cart contents ``flush`` returned once they were checked out."""
+
+
+class DatabaseCartStore(BaseCartStore):
+    def get_cart(self, user):
+        cart, _ = Cart.objects.get_or_create(user=user)
+        return cart
+
+    def apply(self, user, mutation, expected_version=None):
+        return Cart.objects.apply_mutation(user, mutation, expected_version)
+
+
+class RedisCartStore(BaseCartStore):
+    """Keeps active carts in Redis hashes, one field per menu item, and writes them back lazily.
+
+    Each hash also carries the ``Cart`` row's id, creation time and version (``_id``,
+    ``_created_at``, ``_version``), so reading a cart never touches Postgres once it is hot.
+    Increments are plain HINCRBYs and never conflict; only overwrites and compare-and-swap
+    writes WATCH the hash. An increment that lands just after the hash was cleared recreates it
+    without the meta fields; ``_load`` restores them from the ``Cart`` row.
+    """
+    key_prefix = 'cart:'
+    dirty_key = 'cart:dirty'
+    meta_fields = ('_id', '_created_at', '_version')
+
+    def __init__(self, client=None):
+        self._client = client
+        self.ttl = int(settings.CART_STORE['TTL'].total_seconds())
+
+    @property
+    def client(self):
+        if self._client is None:
+            self._client = get_redis()
+        return self._client
+
+    def key(self, user_id):
+        return f'{self.key_prefix}{user_id}'
+
+    def _load(self, user_id):
+        key = self.key(user_id)
+        with self.client.pipeline() as pipe:
+            while True:
+                try:
+                    pipe.watch(key)
+                    fields = pipe.hgetall(key)
+                    if fields and '_id' in fields:
+                        pipe.reset()
+                        break
+                    cart, _ = Cart.objects.get_or_create(user_id=user_id)
+                    meta = {'_id': cart.pk, '_created_at': cart.created_at.isoformat()}
+                    pipe.multi()
+                    if fields:
+                        # only increments made after the hash was cleared: they go on top of the row's
+                        # version, and the row's items were checked out
+                        pipe.hset(key, mapping=meta)
+                        pipe.hincrby(key, '_version', cart.version)
+                    else:
+                        pipe.hset(key, mapping={**meta, '_version': cart.version, **cart.items})
+                    pipe.hgetall(key)
+                    fields = pipe.execute()[-1]
+                    break
+                except WatchError:
+                    continue
+        self.client.expire(key, self.ttl)
+        return fields
+
+    def _cart(self, user_id, fields):
+        return Cart(
+            id=int(fields['_id']),
+            user_id=user_id,
+            created_at=parse_datetime(str(fields['_created_at'])),
+            version=int(fields['_version']),
+            items={key: int(value) for key, value in fields.items() if key not in self.meta_fields},
+        )
+
+    def get_cart(self, user):
+        return self._cart(user.pk, self._load(user.pk))
+
+    def _queue_writes(self, pipe, user_id, mutation, current):
+        key = self.key(user_id)
+        for menu_item_id, quantity in mutation.add.items():
+            pipe.hincrby(key, menu_item_id, quantity)
+        for menu_item_id, quantity in mutation.update.items():
+            if menu_item_id not in current and menu_item_id not in mutation.add:
+                continue
+            if quantity <= 0:
+                pipe.hdel(key, menu_item_id)
+            else:
+                pipe.hset(key, menu_item_id, quantity)
+        if mutation.remove:
+            pipe.hdel(key, *mutation.remove)
+        pipe.hincrby(key, '_version', 1)
+        pipe.sadd(self.dirty_key, user_id)
+        pipe.hgetall(key)
+
+    def apply(self, user, mutation, expected_version=None):
+        fields = self._load(user.pk)
+        if not mutation:
+            cart = self._cart(user.pk, fields)
+            if expected_version is not None and expected_version != cart.version:
+                raise CartConflict(cart.version)
+            return cart.version, cart.items
+
+        if not mutation.update and expected_version is None:
+            pipe = self.client.pipeline()
+            self._queue_writes(pipe, user.pk, mutation, {})
+            fields = pipe.execute()[-1]
+            if '_id' not in fields:
+                fields = self._load(user.pk)
+            cart = self._cart(user.pk, fields)
+            return cart.version, cart.items
+
+        key = self.key(user.pk)
+        with self.client.pipeline() as pipe:
+            while True:
+                try:
+                    pipe.watch(key)
+                    fields = pipe.hgetall(key)
+                    if '_id' not in fields:
+                        pipe.reset()
+                        self._load(user.pk)
+                        continue
+                    cart = self._cart(user.pk, fields)
+                    if expected_version is not None and expected_version != cart.version:
+                        raise CartConflict(cart.version)
+                    pipe.multi()
+                    self._queue_writes(pipe, user.pk, mutation, cart.items)
+                    cart = self._cart(user.pk, pipe.execute()[-1])
+                    return cart.version, cart.items
+                except WatchError:
+                    continue
+
+    def _write_back(self, user_ids):
+        pipe = self.client.pipeline()
+        for user_id in user_ids:
+            pipe.hgetall(self.key(user_id))
+        written = {
+            int(user_id): fields if '_id' in fields else self._load(int(user_id))
+            for user_id, fields in zip(user_ids, pipe.execute())
+            if fields
+        }
+        carts = [self._cart(user_id, fields) for user_id, fields in written.items()]
+        Cart.objects.bulk_create(carts, update_conflicts=True, unique_fields=['user'],
+                                 update_fields=['items', 'version'])
+        return written
+
+    def flush(self, user):
+        self.client.srem(self.dirty_key, user.pk)
+        return self._write_back([user.pk]).get(user.pk)
+
+    def flush_dirty(self):
+        batch_size = settings.CART_STORE['FLUSH_BATCH_SIZE']
+        written = 0
+        while True:
+            user_ids = self.client.spop(self.dirty_key, batch_size)
+            if not user_ids:
+                return written
+            written += len(self._write_back(user_ids))
+
+    def clear(self, user, flushed=None):
+        """Drop the ``flushed`` cart; changes made after the flush stay in the cart."""
+        key = self.key(user.pk)
+        with self.client.pipeline() as pipe:
+            while True:
+                try:
+                    pipe.watch(key)
+                    fields = pipe.hgetall(key)
+                    pipe.multi()
+                    if not fields or flushed is None or fields.get('_version') == flushed['_version']:
+                        pipe.delete(key)
+                        pipe.srem(self.dirty_key, user.pk)
+                    else:
+                        # keep what was added on top of the checked-out quantities
+                        for menu_item_id, quantity in flushed.items():
+                            if menu_item_id in self.meta_fields or menu_item_id not in fields:
+                                continue
+                            remaining = int(fields[menu_item_id]) - int(quantity)
+                            if remaining > 0:
+                                pipe.hset(key, menu_item_id, remaining)
+                            else:
+                                pipe.hdel(key, menu_item_id)
+                        pipe.hincrby(key, '_version', 1)
+                        pipe.sadd(self.dirty_key, user.pk)
+                    pipe.execute()
+                    return
+                except WatchError:
+                    continue
+
+
+class LocMemCartStore(RedisCartStore):
+    """``RedisCartStore`` on top of an in-process fake, for tests and local development."""
+
+    def __init__(self, client=None):
+        super().__init__(client or LocalRedis())
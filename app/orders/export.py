@@ -0,0 +1,58 @@
+import csv
+from itertools import groupby
+
+from django.core.serializers.json import DjangoJSONEncoder
+
+from .models import OrderItem
+
+ORDER_FIELDS = {
+    'id': 'order_id',
+    'user_id': 'order__user_id',
+    'created_at': 'order__created_at',
+    'delivery_time': 'order__delivery_time',
+    'delivery_address': 'order__delivery_address',
+    'is_delivered': 'order__is_delivered',
+    'total_price': 'order__total_price',
+}
+ORDER_COLUMNS = tuple(ORDER_FIELDS)
+ITEM_COLUMNS = ('menu_item_id', 'quantity', 'unit_price', 'line_total')
+CSV_HEADER = tuple(f'order_{column}' if column == 'id' else column for column in ORDER_COLUMNS) + ITEM_COLUMNS
+
+
+def export_rows(orders, chunk_size=2000):
+    """Yield one flat tuple per order line, ordered by order, through a server-side cursor."""
+    return (
+        OrderItem.objects.filter(order__in=orders.order_by())
+        .order_by('order_id', 'id')
+        .values_list(*ORDER_FIELDS.values(), *ITEM_COLUMNS)
+        .iterator(chunk_size=chunk_size)
+    )
+
+
+def stream_ndjson(rows):
+    """One JSON object per order, with its lines nested under ``items``."""
+    encoder = DjangoJSONEncoder()
+    width = len(ORDER_COLUMNS)
+    for order, lines in groupby(rows, key=lambda row: row[:width]):
+        record = dict(zip(ORDER_COLUMNS, order))
+        record['items'] = [dict(zip(ITEM_COLUMNS, line[width:])) for line in lines]
+        yield encoder.encode(record) + '\n'
+
+
+class _Echo:
+    def write(self, value):
+        return value
+
+
+def stream_csv(rows):
+    """One CSV row per order line, order columns repeated."""
+    writer = csv.writer(_Echo())
+    yield writer.writerow(CSV_HEADER)
+    for row in rows:
+        yield writer.writerow(row)
+
+
+EXPORT_FORMATS = {
+    'ndjson': (stream_ndjson, 'application/x-ndjson'),
+    'csv': (stream_csv, 'text/csv'),
+}
@@ -0,0 +1,203 @@
+import csv
+import io
+import json
+from decimal import Decimal, InvalidOperation
+from itertools import groupby
+
+from django.contrib.auth import get_user_model
+from django.db import connection, transaction
+from django.db.models import F
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .export import CSV_HEADER, ITEM_COLUMNS
+from restaurant.catalog import get_catalog
+from .models import Order, OrderImport, OrderItem
+
+ORDER_COPY_COLUMNS = ('id', 'user_id', 'created_at', 'delivery_time', 'delivery_address', 'is_delivered',
+                      'total_price')
+ITEM_COPY_COLUMNS = ('order_id', 'menu_item_id', 'quantity', 'unit_price', 'line_total')
+TRUE_VALUES = {'true', 't', '1', 'yes'}
+FALSE_VALUES = {'false', 'f', '0', 'no'}
+# Postgres integer and numeric(10, 2) bounds; a value past them would fail the whole COPY.
+MAX_QUANTITY = 2 ** 31 - 1
+MAX_PRICE = Decimal('99999999.99')
+MAX_ADDRESS_LENGTH = Order._meta.get_field('delivery_address').max_length
+
+
+class ImportRowError(ValueError):
+    pass
+
+
+def read_ndjson(stream):
+    """One order per line, in the shape written by the NDJSON export."""
+    for line in stream:
+        if line.strip():
+            try:
+                yield json.loads(line)
+            except ValueError:
+                yield line
+
+
+def read_csv(stream):
+    """One order line per row, in the shape written by the CSV export; rows of an order must be adjacent."""
+    reader = csv.DictReader(stream)
+    order_columns = [column for column in reader.fieldnames or () if column not in ITEM_COLUMNS]
+    for _, rows in groupby(reader, key=lambda row: row.get(CSV_HEADER[0])):
+        rows = list(rows)
+        record = {column: rows[0][column] for column in order_columns}
+        record['id'] = record.pop(CSV_HEADER[0], None)
+        record['items'] = [{column: row.get(column) for column in ITEM_COLUMNS} for row in rows]
+        yield record
+
+
+IMPORT_FORMATS = {
+    'ndjson': read_ndjson,
+    'csv': read_csv,
+}
+
+
+def _blank(value):
+    return value is None or value == ''
+
+
+def _datetime(record, field):
+    value = record.get(field)
+    try:
+        parsed = parse_datetime(value) if isinstance(value, str) else None
+    except ValueError:
+        parsed = None
+    if parsed is None:
+        raise ImportRowError(f"{field} must be an ISO 8601 datetime.")
+    return parsed if timezone.is_aware(parsed) else timezone.make_aware(parsed)
+
+
+def _decimal(record, field):
+    value = record.get(field)
+    if _blank(value):
+        return None
+    try:
+        parsed = Decimal(str(value)).quantize(Decimal('0.01'))
+    except InvalidOperation:
+        parsed = None
+    if parsed is None or not parsed.is_finite():
+        raise ImportRowError(f"{field} must be a decimal number.")
+    return _price(parsed, field)
+
+
+def _price(value, field):
+    if abs(value) > MAX_PRICE:
+        raise ImportRowError(f"{field} must be at most {MAX_PRICE}.")
+    return value
+
+
+def _delivered(value):
+    """Historical orders are delivered unless the input says otherwise."""
+    if _blank(value):
+        return True
+    if isinstance(value, bool):
+        return value
+    if str(value).lower() in TRUE_VALUES:
+        return True
+    if str(value).lower() in FALSE_VALUES:
+        return False
+    raise ImportRowError("is_delivered must be a boolean.")
+
+
+class OrderImporter:
+    """Validate historical order records and load them with ``COPY`` one chunk per transaction.
+
+    Menu item and user ids are checked against sets loaded once up front, so validation costs
+    no queries per record.
+    """
+
+    def __init__(self, checkpoint):
+        self.checkpoint = checkpoint
+        self.menu_item_ids = set(get_catalog().items)
+        self.user_ids = set(get_user_model().objects.values_list('id', flat=True))
+        self._user_emails = None
+
+    def user_id(self, record):
+        if not _blank(record.get('user_email')):
+            if self._user_emails is None:
+                self._user_emails = dict(get_user_model().objects.values_list('email', 'id'))
+            user_id = self._user_emails.get(record['user_email'])
+            if user_id is None:
+                raise ImportRowError(f"Unknown user email {record['user_email']}.")
+            return user_id
+        try:
+            user_id = int(record.get('user_id'))
+        except (TypeError, ValueError, OverflowError):
+            raise ImportRowError("user_id or user_email is required.")
+        if user_id not in self.user_ids:
+            raise ImportRowError(f"Unknown user id {user_id}.")
+        return user_id
+
+    def clean(self, record):
+        """Return ``(order, lines)`` as COPY-ready tuples, without the order id, or raise ImportRowError."""
+        if not isinstance(record, dict):
+            raise ImportRowError("Order must be a JSON object.")
+        address = record.get('delivery_address')
+        if _blank(address):
+            raise ImportRowError("delivery_address is required.")
+        if len(str(address)) > MAX_ADDRESS_LENGTH:
+            raise ImportRowError(f"delivery_address must be at most {MAX_ADDRESS_LENGTH} characters.")
+
+        items = record.get('items') or []
+        if not isinstance(items, list) or not all(isinstance(item, dict) for item in items):
+            raise ImportRowError("items must be a list of objects.")
+        lines = []
+        for item in items:
+            try:
+                menu_item_id, quantity = int(item.get('menu_item_id')), int(item.get('quantity'))
+            except (TypeError, ValueError, OverflowError):
+                raise ImportRowError("Every item needs an integer menu_item_id and quantity.")
+            if menu_item_id not in self.menu_item_ids:
+                raise ImportRowError(f"Unknown menu item id {menu_item_id}.")
+            if not 0 < quantity <= MAX_QUANTITY:
+                raise ImportRowError(f"Item quantity must be between 1 and {MAX_QUANTITY}.")
+            unit_price, line_total = _decimal(item, 'unit_price'), _decimal(item, 'line_total')
+            if line_total is None and unit_price is not None:
+                line_total = _price(unit_price * quantity, 'line_total')
+            lines.append((menu_item_id, quantity, unit_price, line_total))
+        if not lines:
+            raise ImportRowError("Order has no items.")
+
+        total_price = _decimal(record, 'total_price')
+        if total_price is None:
+            if any(line_total is None for *_, line_total in lines):
+                raise ImportRowError("total_price is required when line prices are missing.")
+            total_price = _price(sum(line_total for *_, line_total in lines), 'total_price')
+
+        order = (self.user_id(record), _datetime(record, 'created_at'), _datetime(record, 'delivery_time'),
+                 address, _delivered(record.get('is_delivered')), total_price)
+        return order, lines
+
+    def load(self, orders, consumed, skipped):
+        """COPY ``orders`` and their lines and advance the checkpoint by ``consumed`` input records, atomically."""
+        with transaction.atomic(), connection.cursor() as cursor:
+            ids = []
+            if orders:
+                cursor.execute(
+                    "SELECT nextval(pg_get_serial_sequence(%s, 'id')) FROM generate_series(1, %s)",
+                    [Order._meta.db_table, len(orders)],
+                )
+                ids = [order_id for order_id, in cursor.fetchall()]
+            order_rows = [(order_id, *order) for order_id, (order, _) in zip(ids, orders)]
+            item_rows = [(order_id, *line) for order_id, (_, lines) in zip(ids, orders) for line in lines]
+            self.copy(cursor, Order._meta.db_table, ORDER_COPY_COLUMNS, order_rows)
+            self.copy(cursor, OrderItem._meta.db_table, ITEM_COPY_COLUMNS, item_rows)
+            OrderImport.objects.filter(pk=self.checkpoint.pk).update(
+                position=F('position') + consumed, orders=F('orders') + len(order_rows),
+                lines=F('lines') + len(item_rows), skipped=F('skipped') + skipped, updated_at=timezone.now(),
+            )
+        self.checkpoint.refresh_from_db()
+
+    @staticmethod
+    def copy(cursor, table, columns, rows):
+        if not rows:
+            return
+        buffer = io.StringIO()
+        csv.writer(buffer).writerows(rows)
+        buffer.seek(0)
+        cursor.copy_expert(f"COPY {table} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv)", buffer)
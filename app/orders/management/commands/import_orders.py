@@ -0,0 +1,76 @@
+import os
+import sys
+from itertools import islice
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from orders.importer import IMPORT_FORMATS, ImportRowError, OrderImporter
+from orders.models import OrderImport
+
+
+class Command(BaseCommand):
+    help = ("Bulk-load historical orders from CSV or NDJSON (the order export formats) with COPY. "
+            "Progress is checkpointed per chunk; rerunning the same import resumes where it stopped.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="Input file, or '-' for stdin.")
+        parser.add_argument('--input-format', choices=list(IMPORT_FORMATS),
+                            help="Defaults to the file extension.")
+        parser.add_argument('--name', help="Checkpoint name; defaults to the absolute input path.")
+        parser.add_argument('--chunk-size', type=int, default=5000, help="Orders per COPY transaction.")
+        parser.add_argument('--restart', action='store_true', help="Discard the checkpoint and start over.")
+
+    def handle(self, *args, path, input_format, name, chunk_size, restart, **options):
+        if input_format is None:
+            input_format = os.path.splitext(path)[1].lstrip('.').lower()
+            if input_format not in IMPORT_FORMATS:
+                raise CommandError(f"Cannot infer the format of {path}; pass --input-format.")
+        if path == '-' and not name:
+            raise CommandError("--name is required when reading from stdin.")
+        if chunk_size <= 0:
+            raise CommandError("--chunk-size must be positive.")
+
+        source = name or os.path.abspath(path)
+        if restart:
+            OrderImport.objects.filter(source=source).delete()
+        checkpoint, _ = OrderImport.objects.get_or_create(source=source)
+        if checkpoint.finished_at:
+            self.stdout.write(f"{source} was already imported ({checkpoint.orders} orders); use --restart to "
+                              f"import it again.")
+            return
+        if checkpoint.position:
+            self.stdout.write(f"Resuming {source} after {checkpoint.position} orders.")
+
+        importer = OrderImporter(checkpoint)
+        stream = sys.stdin if path == '-' else open(path, newline='', encoding='utf-8')
+        try:
+            records = islice(IMPORT_FORMATS[input_format](stream), checkpoint.position, None)
+            self.load(importer, records, chunk_size)
+        finally:
+            if stream is not sys.stdin:
+                stream.close()
+
+        checkpoint.finished_at = timezone.now()
+        checkpoint.save(update_fields=['finished_at'])
+        self.stdout.write(self.style.SUCCESS(
+            f"Imported {checkpoint.orders} orders with {checkpoint.lines} lines; skipped {checkpoint.skipped}."))
+
+    def load(self, importer, records, chunk_size):
+        position = importer.checkpoint.position
+        while True:
+            chunk = list(islice(records, chunk_size))
+            if not chunk:
+                return
+            orders = []
+            for offset, record in enumerate(chunk, start=position + 1):
+                try:
+                    orders.append(importer.clean(record))
+                except ImportRowError as exc:
+                    source_id = record.get('id') if isinstance(record, dict) else None
+                    self.stderr.write(f"Skipped order #{offset} (source id {source_id}): {exc}")
+            importer.load(orders, consumed=len(chunk), skipped=len(chunk) - len(orders))
+            position += len(chunk)
+            checkpoint = importer.checkpoint
+            self.stdout.write(f"{checkpoint.position} read, {checkpoint.orders} imported, "
+                              f"{checkpoint.skipped} skipped")
@@ -0,0 +1,26 @@
+# Generated by Django 5.1.5 on 2026-10-18 15:03
+
+from django.conf import settings
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    atomic = False
+
+    dependencies = [
+        ('orders', '0004_order_user_created_idx'),
+        ('restaurant', '0001_initial'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name='order',
+            index=models.Index(fields=['user', 'is_delivered', 'delivery_time'], name='order_user_delivery_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='order',
+            index=models.Index(condition=models.Q(('is_delivered', False)), fields=['delivery_time'], name='order_undelivered_due_idx'),
+        ),
+    ]
@@ -0,0 +1,41 @@
+from django.db import migrations
+
+CHUNK_SIZE = 10000
+
+
+def backfill_prices(apps, schema_editor):
+    """Fill the price snapshot of existing order lines from the current menu prices.
+
+    The historical price paid was never stored, so today's price is the best value available.
+    Each chunk is its own short UPDATE, so the table is never locked for the whole backfill.
+    """
+    OrderItem = apps.get_model('orders', 'OrderItem')
+    table = OrderItem._meta.db_table
+    menu_table = apps.get_model('restaurant', 'MenuItem')._meta.db_table
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute(f'SELECT COALESCE(MIN(id), 0), COALESCE(MAX(id), -1) FROM {table} WHERE unit_price IS NULL')
+        start, end = cursor.fetchone()
+        while start <= end:
+            cursor.execute(
+                f'''
+                UPDATE {table} AS line
+                SET unit_price = menu.price, line_total = menu.price * line.quantity
+                FROM {menu_table} AS menu
+                WHERE menu.id = line.menu_item_id AND line.unit_price IS NULL AND line.id BETWEEN %s AND %s
+                ''',
+                [start, start + CHUNK_SIZE - 1],
+            )
+            start += CHUNK_SIZE
+
+
+class Migration(migrations.Migration):
+    atomic = False
+
+    dependencies = [
+        ('orders', '0006_orderitem_price_snapshot'),
+        ('restaurant', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_prices, migrations.RunPython.noop),
+    ]
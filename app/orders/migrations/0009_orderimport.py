@@ -0,0 +1,27 @@
+# Generated by Django 5.1.5 on 2026-10-18 15:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0008_orderevent'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OrderImport',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('source', models.CharField(max_length=255, unique=True)),
+                ('position', models.PositiveBigIntegerField(default=0)),
+                ('orders', models.PositiveBigIntegerField(default=0)),
+                ('lines', models.PositiveBigIntegerField(default=0)),
+                ('skipped', models.PositiveBigIntegerField(default=0)),
+                ('started_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('finished_at', models.DateTimeField(null=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.1.5 on 2026-10-18 18:02
+
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    atomic = False
+
+    dependencies = [
+        ('orders', '0009_orderimport'),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name='orderevent',
+            index=models.Index(condition=models.Q(('processed_at__isnull', True)), fields=['published_at'], name='orderevent_unprocessed_idx'),
+        ),
+    ]
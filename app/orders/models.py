@@ -1,39 +1,136 @@
-from django.db import models
+import json
+
+from django.db import connection, models
 from django.db.models import JSONField
-from restaurant.models import MenuItem
+from .mutations import CartConflict, CartMutation
+from .pricing import price_items
+
+
+class CartManager(models.Manager):
+    apply_mutation_sql = """
+        UPDATE {table} SET
+            items = (
+                SELECT COALESCE(jsonb_object_agg(merged.key, merged.quantity), '{{}}'::jsonb)
+                FROM (
+                    SELECT lines.key, COALESCE(MAX(updates.value::int), SUM(lines.quantity)) AS quantity
+                    FROM (
+                        SELECT key, value::int AS quantity FROM jsonb_each_text({table}.items)
+                        UNION ALL
+                        SELECT key, value::int FROM jsonb_each_text(%s::jsonb)
+                    ) AS lines
+                    LEFT JOIN jsonb_each_text(%s::jsonb) AS updates ON updates.key = lines.key
+                    WHERE lines.key <> ALL(%s::text[])
+                    GROUP BY lines.key
+                ) AS merged
+                WHERE merged.quantity > 0
+            ),
+            version = version + 1
+        WHERE user_id = %s {version_clause}
+        RETURNING version, items
+    """
+
+    def apply_mutation(self, user, mutation, expected_version=None):
+        """Apply ``mutation`` to the user's cart in one UPDATE and return ``(version, items)``.
+
+        Increments from concurrent requests merge in the database and the row lock is only held
+        for the statement. When ``expected_version`` is given the write is a compare-and-swap and
+        ``CartConflict`` is raised if the cart has moved on.
+        """
+        cart, _ = self.get_or_create(user=user)
+        if not mutation:
+            if expected_version is not None and expected_version != cart.version:
+                raise CartConflict(cart.version)
+            return cart.version, cart.items
+
+        sql = self.apply_mutation_sql.format(
+            table=self.model._meta.db_table,
+            version_clause='AND version = %s' if expected_version is not None else '',
+        )
+        params = [json.dumps(mutation.add), json.dumps(mutation.update), sorted(mutation.remove), user.pk]
+        if expected_version is not None:
+            params.append(expected_version)
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            row = cursor.fetchone()
+        if row is None:
+            raise CartConflict(self.filter(user=user).values_list('version', flat=True).first())
+        version, items = row
+        return version, json.loads(items) if isinstance(items, str) else items
 
 
 class Cart(models.Model):
     user = models.OneToOneField('users.CustomUser', on_delete=models.CASCADE)
     created_at = models.DateTimeField(auto_now_add=True)
     items = JSONField(default=dict)
+    version = models.PositiveIntegerField(default=0)
+
+    objects = CartManager()
+
+    def priced(self):
+        return price_items(self.items)
 
     def total_price(self):
-        total = 0
-        for menu_item_id, quantity in self.items.items():
-            try:
-                menu_item = MenuItem.objects.get(id=menu_item_id)
-                total += menu_item.price * quantity
-            except MenuItem.DoesNotExist:
-                continue
-        return total
+        return self.priced().total
+
+    def apply_mutation(self, mutation, expected_version=None):
+        self.version, self.items = Cart.objects.apply_mutation(self.user, mutation, expected_version)
 
     def add_item(self, menu_item_id, quantity):
-        if menu_item_id in self.items:
-            self.items[menu_item_id] += quantity
-        else:
-            self.items[menu_item_id] = quantity
-        self.save()
+        self.apply_mutation(CartMutation(add={menu_item_id: quantity}))
 
     def remove_item(self, menu_item_id):
-        if menu_item_id in self.items:
-            del self.items[menu_item_id]
-            self.save()
+        self.apply_mutation(CartMutation(remove=[menu_item_id]))
 
     def update_item_quantity(self, menu_item_id, quantity):
-        if menu_item_id in self.items:
-            self.items[menu_item_id] = quantity
-            self.save()
+        self.apply_mutation(CartMutation(update={menu_item_id: quantity}))
+
+
+def order_items_prefetch():
+    """Load order lines in one extra query, whatever the number of orders.
+
+    Lines carry the prices paid, so order reads do not join ``restaurant_menuitem``.
+    """
+    return models.Prefetch('orderitem_set', queryset=OrderItem.objects.all())
+
+
+class OrderQuerySet(models.QuerySet):
+    def with_items(self):
+        return self.prefetch_related(order_items_prefetch())
+
+
+class OrderManager(models.Manager.from_queryset(OrderQuerySet)):
+    deliver_due_sql = """
+        WITH due AS (
+            SELECT id FROM {table}
+            WHERE is_delivered = false AND delivery_time <= %s
+            ORDER BY delivery_time
+            LIMIT %s
+            FOR UPDATE SKIP LOCKED
+        ),
+        delivered AS (
+            UPDATE {table} AS o SET is_delivered = true
+            FROM due
+            WHERE o.id = due.id
+            RETURNING o.id, o.user_id
+        )
+        INSERT INTO {event_table} (order_id, event_type, payload, created_at)
+        SELECT delivered.id, %s, jsonb_build_object('email', u.email, 'first_name', u.first_name), now()
+        FROM delivered JOIN {user_table} AS u ON u.id = delivered.user_id
+        RETURNING order_id
+    """
+
+    def deliver_due(self, now, limit):
+        """Mark up to ``limit`` undelivered orders due by ``now`` as delivered and return their ids.
+
+        The update and the matching ``order.delivered`` outbox events are written by the same
+        statement. Rows locked by a concurrent sweep are skipped rather than waited on.
+        """
+        sql = self.deliver_due_sql.format(table=self.model._meta.db_table,
+                                          event_table=OrderEvent._meta.db_table,
+                                          user_table=self.model._meta.get_field('user').related_model._meta.db_table)
+        with connection.cursor() as cursor:
+            cursor.execute(sql, [now, limit, OrderEvent.ORDER_DELIVERED])
+            return [order_id for order_id, in cursor.fetchall()]
 
 
 class Order(models.Model):
@@ -45,11 +142,73 @@ class Order(models.Model):
     is_delivered = models.BooleanField(default=False)
     delivery_address = models.CharField(max_length=255)
 
+    objects = OrderManager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'created_at', 'id'], name='order_user_created_idx'),
+            models.Index(fields=['user', 'is_delivered', 'delivery_time'], name='order_user_delivery_idx'),
+            models.Index(fields=['delivery_time'], condition=models.Q(is_delivered=False),
+                         name='order_undelivered_due_idx'),
+        ]
+
 
 class OrderItem(models.Model):
     order = models.ForeignKey(Order, on_delete=models.CASCADE)
     menu_item = models.ForeignKey('restaurant.MenuItem', on_delete=models.CASCADE)
     quantity = models.PositiveIntegerField(default=1)
+    # prices at checkout time, so order history and reports never need today's MenuItem.price
+    unit_price = models.DecimalField(max_digits=10, decimal_places=2, null=True)
+    line_total = models.DecimalField(max_digits=10, decimal_places=2, null=True)
 
     def __str__(self):
         return f"{self.quantity} x {self.menu_item.name}"
+
+
+class OrderEvent(models.Model):
+    """Transactional outbox: written in the same transaction as the order change it describes.
+
+    ``relay_order_events`` publishes unpublished rows to Celery in batches, and publishes again
+    rows left unprocessed past ``OUTBOX_REDELIVERY_TIMEOUT``; ``process_order_events`` marks them
+    processed, so a redelivered event is a no-op.
+    """
+    ORDER_CREATED = 'order.created'
+    ORDER_DELIVERED = 'order.delivered'
+    EVENT_TYPES = [
+        (ORDER_CREATED, 'Order created'),
+        (ORDER_DELIVERED, 'Order delivered'),
+    ]
+
+    order = models.ForeignKey(Order, on_delete=models.CASCADE)
+    event_type = models.CharField(max_length=32, choices=EVENT_TYPES)
+    payload = JSONField(default=dict)
+    created_at = models.DateTimeField(auto_now_add=True)
+    published_at = models.DateTimeField(null=True)
+    processed_at = models.DateTimeField(null=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['id'], condition=models.Q(published_at__isnull=True),
+                         name='orderevent_unpublished_idx'),
+            models.Index(fields=['published_at'], condition=models.Q(processed_at__isnull=True),
+                         name='orderevent_unprocessed_idx'),
+        ]
+
+
+class OrderImport(models.Model):
+    """Checkpoint of a ``import_orders`` run, advanced in the same transaction as each loaded chunk.
+
+    ``position`` counts the input orders already consumed (loaded or skipped), so a rerun after a
+    crash resumes right after the last committed chunk without duplicating or losing orders.
+    """
+    source = models.CharField(max_length=255, unique=True)
+    position = models.PositiveBigIntegerField(default=0)
+    orders = models.PositiveBigIntegerField(default=0)
+    lines = models.PositiveBigIntegerField(default=0)
+    skipped = models.PositiveBigIntegerField(default=0)
+    started_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    finished_at = models.DateTimeField(null=True)
+
+    def __str__(self):
+        return self.source
@@ -0,0 +1,54 @@
+from restaurant.catalog import get_catalog
+
+# well inside the int range the cart SQL casts quantities to
+MAX_QUANTITY = 1000
+
+
+class CartMutationError(Exception):
+    pass
+
+
+class CartConflict(Exception):
+    def __init__(self, version):
+        super().__init__("Cart version mismatch")
+        self.version = version
+
+
+def _quantity(value):
+    if isinstance(value, bool) or not isinstance(value, int):
+        raise CartMutationError("Quantities must be integers")
+    if abs(value) > MAX_QUANTITY:
+        raise CartMutationError(f"Quantities must not exceed {MAX_QUANTITY}")
+    return value
+
+
+class CartMutation:
+    """A batch of cart changes persisted with a single write.
+
+    ``add`` increments quantities, ``update`` overwrites quantities of lines already in the
+    cart (a quantity <= 0 removes the line) and ``remove`` drops lines.
+    """
+
+    def __init__(self, add=None, update=None, remove=None):
+        self.add = {str(key): _quantity(value) for key, value in (add or {}).items()}
+        self.update = {str(key): _quantity(value) for key, value in (update or {}).items()}
+        self.remove = {str(key) for key in (remove or [])}
+        if any(quantity <= 0 for quantity in self.add.values()):
+            raise CartMutationError("Quantities must be positive")
+
+    def __bool__(self):
+        return bool(self.add or self.update or self.remove)
+
+    def invalid_items(self):
+        """Return the added menu item ids that do not exist in the menu catalog snapshot."""
+        ids = {}
+        invalid = []
+        for key in self.add:
+            try:
+                ids[int(key)] = key
+            except ValueError:
+                invalid.append(key)
+        if ids:
+            catalog = get_catalog()
+            invalid.extend(key for menu_item_id, key in ids.items() if menu_item_id not in catalog)
+        return invalid
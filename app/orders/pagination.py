@@ -0,0 +1,19 @@
+from rest_framework.pagination import CursorPagination
+from rest_framework.settings import api_settings
+
+
+class OrderCursorPagination(CursorPagination):
+    """Keyset pagination over ``(created_at, id)``, served by the ``(user, created_at, id)`` index.
+
+    Pages cost the same however deep the client goes and no ``COUNT(*)`` is run. The
+    ``ordering`` parameter of ``OrderFilter`` picks the direction.
+    """
+    page_size = int(api_settings.PAGE_SIZE)
+    ordering = ('-created_at', '-id')
+    ordering_fields = ('created_at', '-created_at')
+
+    def get_ordering(self, request, queryset, view):
+        ordering = request.query_params.get('ordering')
+        if ordering in self.ordering_fields:
+            return (ordering, '-id' if ordering.startswith('-') else 'id')
+        return self.ordering
@@ -0,0 +1,63 @@
+from collections import namedtuple
+from decimal import Decimal
+
+from restaurant.catalog import get_catalog
+
+PricedLine = namedtuple('PricedLine', ['menu_item_id', 'name', 'unit_price', 'quantity', 'line_total'])
+
+
+class PricedCart:
+    """Line-by-line breakdown of a cart, priced from the menu catalog snapshot."""
+
+    def __init__(self, lines, missing):
+        self.lines = lines
+        self.missing = missing
+
+    @property
+    def total(self):
+        return sum((line.line_total for line in self.lines), Decimal('0'))
+
+    def __iter__(self):
+        return iter(self.lines)
+
+    def __len__(self):
+        return len(self.lines)
+
+    def as_list(self):
+        return [line._asdict() for line in self.lines]
+
+
+def _menu_item_id(key):
+    try:
+        return int(key)
+    except (TypeError, ValueError):
+        return None
+
+
+def price_items(items):
+    """Price a ``{menu_item_id: quantity}`` mapping.
+
+    Unknown or malformed ids are collected in ``missing`` instead of raising, the same way
+    ``Cart.total_price`` used to skip them.
+    """
+    quantities = {}
+    missing = []
+    for key, quantity in items.items():
+        menu_item_id = _menu_item_id(key)
+        if menu_item_id is None:
+            missing.append(key)
+        else:
+            quantities[menu_item_id] = quantities.get(menu_item_id, 0) + quantity
+
+    if not quantities:
+        return PricedCart([], missing)
+
+    catalog = get_catalog()
+    lines = []
+    for menu_item_id, quantity in quantities.items():
+        menu_item = catalog.get(menu_item_id)
+        if menu_item is None:
+            missing.append(menu_item_id)
+            continue
+        lines.append(PricedLine(menu_item_id, menu_item.name, menu_item.price, quantity, menu_item.price * quantity))
+    return PricedCart(lines, missing)
@@ -2,13 +2,12 @@ from rest_framework import serializers
 from .models import OrderItem, Order, Cart
 from datetime import timedelta
 from django.utils import timezone
-from restaurant.serializers import MenuItemSerializer
 
 
 class CartSerializer(serializers.ModelSerializer):
     class Meta:
         model = Cart
-        fields = ['id', 'user', 'created_at', 'items']
+        fields = ['id', 'user', 'created_at', 'items', 'version']
 
     def validate_items(self, value):
         if not isinstance(value, dict):
@@ -17,7 +16,11 @@ class CartSerializer(serializers.ModelSerializer):
 
     def to_representation(self, instance):
         representation = super().to_representation(instance)
-        representation['total_price'] = instance.total_price()
+        priced = self.context.get('priced_cart')
+        if priced is None:
+            priced = instance.priced()
+        representation['lines'] = priced.as_list()
+        representation['total_price'] = priced.total
         return representation
 
 
@@ -32,11 +35,12 @@ class CreateOrderSerializer(serializers.Serializer):
 
 
 class OrderItemSerializer(serializers.ModelSerializer):
-    menu_item = MenuItemSerializer(read_only=True)
+    # the id only: prices come from the line, so reading an order never joins the menu
+    menu_item = serializers.PrimaryKeyRelatedField(read_only=True)
 
     class Meta:
         model = OrderItem
-        fields = ['id', 'menu_item', 'quantity']
+        fields = ['id', 'menu_item', 'quantity', 'unit_price', 'line_total']
 
 
 class OrderSerializer(serializers.ModelSerializer):
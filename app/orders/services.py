@@ -0,0 +1,45 @@
+from django.db import transaction
+
+from .cart_store import get_cart_store
+from .models import Cart, Order, OrderEvent, OrderItem
+
+
+class CheckoutError(Exception):
+    pass
+
+
+def checkout(user, delivery_time, delivery_address):
+    """Turn the user's cart into an order in a single transaction.
+
+    The cart row is locked for the duration so a concurrent checkout or cart edit cannot
+    interleave, prices are read in one query and all order lines are written with one
+    ``bulk_create``. An ``order.created`` outbox event is written in the same transaction;
+    delivery is picked up later by the ``deliver_due_orders`` sweep.
+    """
+    store = get_cart_store()
+    flushed = store.flush(user)
+    with transaction.atomic():
+        cart, _ = Cart.objects.select_for_update().get_or_create(user=user)
+        if not cart.items:
+            raise CheckoutError("Cart is empty")
+
+        priced = cart.priced()
+        if priced.missing:
+            raise CheckoutError(f"Menu items not found: {priced.missing}")
+
+        order = Order.objects.create(user=user, delivery_time=delivery_time, delivery_address=delivery_address,
+                                     total_price=priced.total)
+        OrderItem.objects.bulk_create([
+            OrderItem(order=order, menu_item_id=line.menu_item_id, quantity=line.quantity,
+                      unit_price=line.unit_price, line_total=line.line_total)
+            for line in priced
+        ])
+        OrderEvent.objects.create(order=order, event_type=OrderEvent.ORDER_CREATED,
+                                  payload={'user_id': user.pk, 'total_price': str(priced.total)})
+
+        cart.items = {}
+        cart.version += 1
+        cart.save(update_fields=['items', 'version'])
+
+        transaction.on_commit(lambda: store.clear(user, flushed))
+    return order
@@ -1,10 +1,40 @@
 from rest_framework.test import APITestCase
 from rest_framework import status
 from django.contrib.auth import get_user_model
-from .models import MenuItem, Cart, Order
+from restaurant.models import MenuItem
+from .models import Cart, Order, OrderEvent, OrderImport, OrderItem
 from decimal import Decimal
 from django.utils import timezone
 from datetime import timedelta
+from unittest import mock
+import csv
+import importlib
+import io
+import itertools
+import json
+import os
+import re
+import tempfile
+import threading
+from django.apps import apps as django_apps
+import smtplib
+from django.core import mail
+from django.core.exceptions import ImproperlyConfigured
+from django.core.mail import get_connection
+from django.core.mail.backends import locmem
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from app.notifications import dead_letters, order_delivered_message, send_batch
+from app.redis_client import get_redis
+from app.tasks import (deliver_due_orders, process_order_events, relay_order_events,
+                       send_order_delivered_emails)
+from .filters import OrderFilter
+from .importer import OrderImporter
+from .cart_store import get_cart_store
+from .mutations import CartMutation
+from .services import checkout, CheckoutError
 
 class CartViewTests(APITestCase):
 
@@ -50,6 +80,154 @@ class CartViewTests(APITestCase):
         self.cart.refresh_from_db()
         self.assertNotIn(str(self.menu_item.id), self.cart.items)
 
+    def test_remove_items_keeps_other_items(self):
+        other = MenuItem.objects.create(name='Test Pasta', description='Pasta', price=Decimal('8.50'))
+        self.cart.add_item(self.menu_item.id, 1)
+        self.cart.add_item(other.id, 2)
+        response = self.client.delete('/api/cart/', {'items': [self.menu_item.id]}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.cart.refresh_from_db()
+        self.assertEqual(self.cart.items, {str(other.id): 2})
+
+    def test_add_many_items_uses_one_read_and_one_write(self):
+        menu_items = [
+            MenuItem.objects.create(name=f'Dish {i}', description='Dish', price=Decimal('3.00'))
+            for i in range(10)
+        ]
+        data = {'items': {str(item.id): 2 for item in menu_items}}
+        # menu item validation, cart lookup, cart update
+        with self.assertNumQueries(3):
+            response = self.client.post('/api/cart/', data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.cart.refresh_from_db()
+        self.assertEqual(self.cart.items, data['items'])
+
+    def test_add_items_with_unknown_id_changes_nothing(self):
+        data = {'items': {str(self.menu_item.id): 1, '999999': 1}}
+        response = self.client.post('/api/cart/', data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.cart.refresh_from_db()
+        self.assertEqual(self.cart.items, {})
+
+    def test_add_items_rejects_invalid_quantity(self):
+        response = self.client.post('/api/cart/', {'items': {str(self.menu_item.id): 'two'}}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class CartPatchTests(APITestCase):
+
+    def setUp(self):
+        User = get_user_model()
+        self.user = User.objects.create_user(email='testuser@example.com', password='testpassword')
+        self.client.force_authenticate(user=self.user)
+        self.pizza = MenuItem.objects.create(name='Test Pizza', description='Pizza', price=Decimal('10.99'))
+        self.pasta = MenuItem.objects.create(name='Test Pasta', description='Pasta', price=Decimal('8.50'))
+        self.cart = Cart.objects.create(user=self.user, items={str(self.pizza.id): 1})
+
+    def test_patch_applies_delta_and_bumps_version(self):
+        data = {'add': {str(self.pizza.id): 2, str(self.pasta.id): 1}, 'update': {}, 'remove': []}
+        response = self.client.patch('/api/cart/', data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data, {'version': 1, 'items': {str(self.pizza.id): 3, str(self.pasta.id): 1}})
+
+        data = {'update': {str(self.pizza.id): 0}, 'remove': [self.pasta.id]}
+        response = self.client.patch('/api/cart/', data, format='json')
+        self.assertEqual(response.data, {'version': 2, 'items': {}})
+
+    def test_increments_from_stale_clients_merge(self):
+        self.client.patch('/api/cart/', {'add': {str(self.pasta.id): 1}}, format='json')
+        # a second tab that never saw the first change still adds on top of it
+        response = self.client.patch('/api/cart/', {'add': {str(self.pizza.id): 1}}, format='json')
+        self.assertEqual(response.data['items'], {str(self.pizza.id): 2, str(self.pasta.id): 1})
+
+    def test_patch_with_stale_version_conflicts(self):
+        self.client.patch('/api/cart/', {'add': {str(self.pasta.id): 1}}, format='json')
+        response = self.client.patch('/api/cart/', {'version': 0, 'add': {str(self.pizza.id): 1}}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+        self.assertEqual(response.data['version'], 1)
+        self.cart.refresh_from_db()
+        self.assertEqual(self.cart.items, {str(self.pizza.id): 1, str(self.pasta.id): 1})
+
+    def test_patch_rejects_unknown_items(self):
+        response = self.client.patch('/api/cart/', {'add': {'999999': 1}}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_patch_rejects_out_of_range_quantities(self):
+        for data in ({'add': {str(self.pizza.id): 2 ** 31}}, {'update': {str(self.pizza.id): -2 ** 40}}):
+            response = self.client.patch('/api/cart/', data, format='json')
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.cart.refresh_from_db()
+        self.assertEqual(self.cart.items, {str(self.pizza.id): 1})
+
+    @override_settings(CART_STORE={'BACKEND': 'orders.cart_store.LocMemCartStore', 'TTL': timedelta(days=1),
+                                   'FLUSH_BATCH_SIZE': 10})
+    def test_patch_with_redis_store(self):
+        get_cart_store().client.flushall()
+        response = self.client.patch('/api/cart/', {'add': {str(self.pasta.id): 2}}, format='json')
+        self.assertEqual(response.data, {'version': 1, 'items': {str(self.pizza.id): 1, str(self.pasta.id): 2}})
+        response = self.client.patch('/api/cart/', {'version': 1, 'update': {str(self.pasta.id): 5}}, format='json')
+        self.assertEqual(response.data['version'], 2)
+        response = self.client.patch('/api/cart/', {'version': 1, 'remove': [self.pizza.id]}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+        self.assertEqual(response.data['version'], 2)
+
+
+class ConcurrentCartUpdateTests(TransactionTestCase):
+
+    def test_concurrent_increments_are_not_lost(self):
+        user = get_user_model().objects.create_user(email='testuser@example.com', password='testpassword')
+        menu_item = MenuItem.objects.create(name='Test Pizza', description='Pizza', price=Decimal('10.99'))
+        Cart.objects.create(user=user)
+        mutation = CartMutation(add={menu_item.id: 1})
+
+        def add_one():
+            try:
+                Cart.objects.apply_mutation(user, mutation)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=add_one) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        cart = Cart.objects.get(user=user)
+        self.assertEqual(cart.items, {str(menu_item.id): 8})
+        self.assertEqual(cart.version, 8)
+
+
+class CartPricingTests(APITestCase):
+
+    def setUp(self):
+        User = get_user_model()
+        self.user = User.objects.create_user(email='testuser@example.com', password='testpassword')
+        self.menu_items = [
+            MenuItem.objects.create(name=f'Dish {i}', description='Dish', price=Decimal('2.50') + i)
+            for i in range(5)
+        ]
+        self.cart = Cart.objects.create(user=self.user, items={str(item.id): 2 for item in self.menu_items})
+
+    def test_total_price_uses_single_query(self):
+        with self.assertNumQueries(1):
+            total = self.cart.total_price()
+        self.assertEqual(total, sum(item.price * 2 for item in self.menu_items))
+
+    def test_priced_skips_unknown_items(self):
+        self.cart.items['999999'] = 1
+        self.cart.items['not-an-id'] = 1
+        priced = self.cart.priced()
+        self.assertEqual(len(priced), len(self.menu_items))
+        self.assertCountEqual(priced.missing, [999999, 'not-an-id'])
+
+    def test_get_cart_returns_line_breakdown(self):
+        self.client.force_authenticate(user=self.user)
+        response = self.client.get('/api/cart/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data['lines']), len(self.menu_items))
+        line = response.data['lines'][0]
+        self.assertEqual(line['line_total'], line['unit_price'] * line['quantity'])
+
 
 class OrderViewTests(APITestCase):
 
@@ -86,6 +264,319 @@ class OrderViewTests(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
         self.assertEqual(response.data['error'], 'Cart is empty')
 
+
+@override_settings(CART_STORE={'BACKEND': 'orders.cart_store.LocMemCartStore', 'TTL': timedelta(days=1),
+                               'FLUSH_BATCH_SIZE': 2})
+class RedisCartStoreTests(APITestCase):
+
+    def setUp(self):
+        get_cart_store().client.flushall()
+        User = get_user_model()
+        self.user = User.objects.create_user(email='testuser@example.com', password='testpassword')
+        self.client.force_authenticate(user=self.user)
+        self.menu_item = MenuItem.objects.create(
+            name='Test Pizza', description='Delicious pizza', price=Decimal('10.99'))
+
+    def test_cart_changes_stay_in_redis_until_flushed(self):
+        self.client.post('/api/cart/', {'items': {str(self.menu_item.id): 2}}, format='json')
+        self.client.post('/api/cart/', {'items': {str(self.menu_item.id): 1}}, format='json')
+        self.assertEqual(Cart.objects.get(user=self.user).items, {})
+
+        # a hot cart is read from Redis and priced from the menu catalog snapshot
+        with self.assertNumQueries(0):
+            response = self.client.get('/api/cart/')
+        self.assertEqual(response.data['items'], {str(self.menu_item.id): 3})
+        self.assertEqual(response.data['total_price'], self.menu_item.price * 3)
+
+        self.assertEqual(get_cart_store().flush_dirty(), 1)
+        self.assertEqual(Cart.objects.get(user=self.user).items, {str(self.menu_item.id): 3})
+
+    def test_flush_dirty_writes_in_batches(self):
+        User = get_user_model()
+        users = [self.user] + [User.objects.create_user(email=f'user{i}@example.com', password='pw') for i in range(4)]
+        store = get_cart_store()
+        for user in users:
+            store.apply(user, CartMutation(add={self.menu_item.id: 1}))
+        self.assertEqual(store.flush_dirty(), len(users))
+        self.assertEqual(Cart.objects.filter(items={str(self.menu_item.id): 1}).count(), len(users))
+        self.assertEqual(store.flush_dirty(), 0)
+
+    def test_update_and_remove(self):
+        store = get_cart_store()
+        store.apply(self.user, CartMutation(add={self.menu_item.id: 2, '999': 1}))
+        store.apply(self.user, CartMutation(update={self.menu_item.id: 5, '12345': 1}, remove=['999']))
+        self.assertEqual(store.get_cart(self.user).items, {str(self.menu_item.id): 5})
+
+    def test_checkout_writes_back_and_clears_cart(self):
+        self.client.post('/api/cart/', {'items': {str(self.menu_item.id): 2}}, format='json')
+        data = {'delivery_time': timezone.now() + timedelta(hours=1), 'delivery_address': 'Test Address'}
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/api/order/', data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['total_price'], str(self.menu_item.price * 2))
+        self.assertEqual(self.client.get('/api/cart/').data['items'], {})
+
+    def test_increment_racing_clear_recreates_meta(self):
+        store = get_cart_store()
+        store.apply(self.user, CartMutation(add={self.menu_item.id: 2}))
+        store.flush(self.user)
+        load = store._load
+
+        def load_then_clear(user_id):
+            fields = load(user_id)
+            store._load = load
+            # a checkout commits in between: the row is emptied and the hash deleted
+            Cart.objects.filter(user=self.user).update(items={}, version=2)
+            store.clear(self.user)
+            return fields
+
+        with mock.patch.object(store, '_load', side_effect=load_then_clear):
+            version, items = store.apply(self.user, CartMutation(add={self.menu_item.id: 1}))
+        self.assertEqual((version, items), (3, {str(self.menu_item.id): 1}))
+        self.assertEqual(store.get_cart(self.user).version, 3)
+        self.assertEqual(store.flush_dirty(), 1)
+        cart = Cart.objects.get(user=self.user)
+        self.assertEqual((cart.version, cart.items), (3, {str(self.menu_item.id): 1}))
+
+    def test_items_added_during_checkout_survive(self):
+        store = get_cart_store()
+        store.apply(self.user, CartMutation(add={self.menu_item.id: 2}))
+        flush = store.flush
+
+        def flush_then_add(user):
+            flushed = flush(user)
+            store.apply(user, CartMutation(add={self.menu_item.id: 1}))
+            return flushed
+
+        with mock.patch.object(store, 'flush', side_effect=flush_then_add), \
+                self.captureOnCommitCallbacks(execute=True):
+            order = checkout(self.user, timezone.now() + timedelta(hours=1), 'Test Address')
+        self.assertEqual(order.orderitem_set.get().quantity, 2)
+        self.assertEqual(store.get_cart(self.user).items, {str(self.menu_item.id): 1})
+        self.assertEqual(store.flush_dirty(), 1)
+        self.assertEqual(Cart.objects.get(user=self.user).items, {str(self.menu_item.id): 1})
+
+
+class RedisClientTests(TestCase):
+
+    @override_settings(REDIS_URL=None, TESTING=False)
+    def test_stand_in_is_refused_outside_tests(self):
+        with mock.patch('app.redis_client._client', None):
+            with self.assertRaises(ImproperlyConfigured):
+                get_redis()
+
+
+class CheckoutServiceTests(APITestCase):
+
+    def setUp(self):
+        User = get_user_model()
+        self.user = User.objects.create_user(email='testuser@example.com', password='testpassword')
+        self.menu_items = [
+            MenuItem.objects.create(name=f'Dish {i}', description='Dish', price=Decimal('4.00'))
+            for i in range(10)
+        ]
+        self.cart = Cart.objects.create(user=self.user, items={str(item.id): 1 for item in self.menu_items})
+        self.delivery_time = timezone.now() + timedelta(hours=1)
+
+    def test_checkout_query_count_is_independent_of_cart_size(self):
+        # savepoint, cart lock, prices, order insert, bulk item insert, outbox insert, cart update,
+        # release savepoint
+        with self.assertNumQueries(8):
+            order = checkout(self.user, self.delivery_time, 'Test Address')
+        self.assertEqual(order.orderitem_set.count(), len(self.menu_items))
+        self.assertEqual(order.total_price, Decimal('40.00'))
+        self.cart.refresh_from_db()
+        self.assertEqual(self.cart.items, {})
+        event = OrderEvent.objects.get(order=order)
+        self.assertEqual(event.event_type, OrderEvent.ORDER_CREATED)
+        self.assertIsNone(event.published_at)
+
+    def test_failed_checkout_rolls_back(self):
+        with mock.patch('orders.services.OrderItem.objects.bulk_create', side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                checkout(self.user, self.delivery_time, 'Test Address')
+        self.assertFalse(Order.objects.exists())
+        self.cart.refresh_from_db()
+        self.assertEqual(len(self.cart.items), len(self.menu_items))
+
+    def test_checkout_snapshots_prices(self):
+        order = checkout(self.user, self.delivery_time, 'Test Address')
+        MenuItem.objects.update(price=Decimal('99.00'))
+        self.client.force_authenticate(user=self.user)
+        response = self.client.get(f'/api/order/{order.id}/')
+        self.assertEqual(response.data['total_price'], '40.00')
+        self.assertEqual({line['unit_price'] for line in response.data['items']}, {'4.00'})
+        self.assertEqual({line['line_total'] for line in response.data['items']}, {'4.00'})
+
+    def test_backfill_migration_fills_missing_prices(self):
+        backfill = importlib.import_module('orders.migrations.0007_backfill_orderitem_prices')
+        order = Order.objects.create(user=self.user, total_price=Decimal('8.00'), delivery_time=self.delivery_time,
+                                     delivery_address='Test Address')
+        line = OrderItem.objects.create(order=order, menu_item=self.menu_items[0], quantity=2)
+        with connection.schema_editor() as schema_editor:
+            backfill.backfill_prices(django_apps, schema_editor)
+        line.refresh_from_db()
+        self.assertEqual((line.unit_price, line.line_total), (Decimal('4.00'), Decimal('8.00')))
+
+    def test_checkout_rejects_unknown_items(self):
+        self.cart.items['999999'] = 1
+        self.cart.save()
+        with self.assertRaises(CheckoutError):
+            checkout(self.user, self.delivery_time, 'Test Address')
+        self.assertFalse(Order.objects.exists())
+
+
+@override_settings(DELIVERY_SWEEP_BATCH_SIZE=3, DELIVERY_NOTIFICATION_BATCH_SIZE=2)
+class DeliverySweepTests(APITestCase):
+
+    def setUp(self):
+        User = get_user_model()
+        self.user = User.objects.create_user(email='testuser@example.com', password='testpassword', first_name='Test')
+        now = timezone.now()
+        self.due = Order.objects.bulk_create([
+            Order(user=self.user, total_price=Decimal('10.00'), delivery_time=now - timedelta(minutes=i),
+                  delivery_address='Test Address')
+            for i in range(5)
+        ])
+        self.pending = Order.objects.create(user=self.user, total_price=Decimal('10.00'),
+                                            delivery_time=now + timedelta(hours=1), delivery_address='Test Address')
+
+    def test_due_orders_are_delivered_in_bulk(self):
+        self.assertEqual(deliver_due_orders(), len(self.due))
+        self.assertEqual(set(Order.objects.filter(is_delivered=True).values_list('id', flat=True)),
+                         {order.id for order in self.due})
+        self.pending.refresh_from_db()
+        self.assertFalse(self.pending.is_delivered)
+
+        events = OrderEvent.objects.filter(event_type=OrderEvent.ORDER_DELIVERED)
+        self.assertCountEqual(events.values_list('order_id', flat=True), [order.id for order in self.due])
+        self.assertEqual(events[0].payload, {'email': 'testuser@example.com', 'first_name': 'Test'})
+
+    def test_sweep_is_idempotent(self):
+        deliver_due_orders()
+        self.assertEqual(deliver_due_orders(), 0)
+        self.assertEqual(OrderEvent.objects.count(), len(self.due))
+
+    @override_settings(OUTBOX_RELAY_BATCH_SIZE=2)
+    @mock.patch('app.tasks.send_order_delivered_emails.delay')
+    @mock.patch('app.tasks.process_order_events.delay')
+    def test_relay_publishes_events_to_idempotent_consumer(self, publish, notify):
+        deliver_due_orders()
+        self.assertEqual(relay_order_events(), len(self.due))
+        self.assertFalse(OrderEvent.objects.filter(published_at__isnull=True).exists())
+        batches = [call.args[0] for call in publish.call_args_list]
+        self.assertEqual([len(batch) for batch in batches], [2, 2, 1])
+
+        for batch in batches:
+            process_order_events(batch)
+        notifications = [notification for call in notify.call_args_list for notification in call.args[0]]
+        self.assertCountEqual([order_id for _, _, order_id in notifications], [order.id for order in self.due])
+        self.assertTrue(all(len(call.args[0]) <= 2 for call in notify.call_args_list))
+
+        notify.reset_mock()
+        self.assertEqual(process_order_events(batches[0]), 0)
+        notify.assert_not_called()
+
+    @mock.patch('app.tasks.process_order_events.delay', side_effect=OSError('broker down'))
+    def test_events_stay_unpublished_when_broker_is_down(self, publish):
+        deliver_due_orders()
+        with self.assertRaises(OSError):
+            relay_order_events()
+        self.assertEqual(OrderEvent.objects.filter(published_at__isnull=True).count(), len(self.due))
+
+    @mock.patch('app.tasks.send_order_delivered_emails.delay')
+    @mock.patch('app.tasks.process_order_events.delay')
+    def test_events_lost_after_publishing_are_published_again(self, publish, notify):
+        deliver_due_orders()
+        relay_order_events()
+        self.assertEqual(relay_order_events(), 0)
+
+        OrderEvent.objects.update(published_at=timezone.now() - timedelta(minutes=10))
+        process_order_events([OrderEvent.objects.earliest('id').id])
+        publish.reset_mock()
+        self.assertEqual(relay_order_events(), len(self.due) - 1)
+        republished = [event_id for call in publish.call_args_list for event_id in call.args[0]]
+        self.assertCountEqual(republished, OrderEvent.objects.filter(processed_at__isnull=True)
+                              .values_list('id', flat=True))
+        process_order_events(republished)
+        self.assertFalse(OrderEvent.objects.filter(processed_at__isnull=True).exists())
+
+    def test_notifications_are_sent(self):
+        send_order_delivered_emails([['testuser@example.com', 'Test', self.due[0].id]])
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertIn(f'#{self.due[0].id}', mail.outbox[0].body)
+
+
+class OutboxRelayRaceTests(TransactionTestCase):
+
+    @mock.patch('app.tasks.send_order_delivered_emails.delay')
+    def test_consumer_started_inside_relay_transaction_waits_for_commit(self, notify):
+        user = get_user_model().objects.create_user(email='testuser@example.com', password='testpassword')
+        Order.objects.create(user=user, total_price=Decimal('10.00'), delivery_time=timezone.now(),
+                             delivery_address='Test Address')
+        deliver_due_orders()
+        results = []
+
+        def consume(event_ids):
+            try:
+                results.append(process_order_events(event_ids))
+            finally:
+                connection.close()
+
+        def publish(event_ids):
+            # the broker hands the batch to a worker before the relay has committed
+            thread = threading.Thread(target=consume, args=(event_ids,))
+            thread.start()
+            thread.join(timeout=0.5)
+            threads.append(thread)
+
+        threads = []
+        with mock.patch('app.tasks.process_order_events.delay', side_effect=publish):
+            relay_order_events()
+        threads[0].join()
+
+        self.assertEqual(results, [1])
+        self.assertFalse(OrderEvent.objects.filter(processed_at__isnull=True).exists())
+        notify.assert_called_once()
+
+
+@override_settings(NOTIFICATION_RETRY_DELAY=0)
+class NotificationBatchTests(APITestCase):
+
+    def setUp(self):
+        get_redis().flushall()
+        self.notifications = [[f'user{i}@example.com', f'User {i}', i] for i in range(5)]
+
+    def test_batch_is_sent_over_one_connection(self):
+        with mock.patch('app.notifications.get_connection', wraps=get_connection) as connection:
+            self.assertEqual(send_order_delivered_emails(self.notifications), 5)
+        connection.assert_called_once()
+        self.assertEqual([message.to for message in mail.outbox], [[email] for email, _, _ in self.notifications])
+
+    def test_failed_messages_are_retried_then_dead_lettered(self):
+        send_messages = locmem.EmailBackend.send_messages
+
+        def refuse_bad_recipient(backend, messages):
+            if messages[0].to == ['bad@example.com']:
+                raise smtplib.SMTPRecipientsRefused({'bad@example.com': (550, b'No such user')})
+            return send_messages(backend, messages)
+
+        notifications = self.notifications + [['bad@example.com', 'Bad', 99]]
+        with mock.patch.object(locmem.EmailBackend, 'send_messages', refuse_bad_recipient):
+            send_order_delivered_emails.apply(args=[notifications])
+
+        self.assertEqual(len(mail.outbox), 5)
+        dead = dead_letters()
+        self.assertEqual(len(dead), 1)
+        self.assertEqual(dead[0]['to'], ['bad@example.com'])
+        self.assertIn('SMTPRecipientsRefused', dead[0]['error'])
+
+    def test_unreachable_server_fails_whole_batch(self):
+        with mock.patch.object(locmem.EmailBackend, 'open', side_effect=OSError('connection refused')):
+            failures = send_batch([order_delivered_message(*notification) for notification in self.notifications])
+        self.assertEqual(len(failures), 5)
+
+
 class OrderListViewTests(APITestCase):
 
     def setUp(self):
@@ -115,6 +606,127 @@ class OrderListViewTests(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
 
 
+class OrderQueryBudgetTests(APITestCase):
+    # queries allowed per request, independent of page size and number of order lines
+    ORDER_LIST_BUDGET = 3  # count, orders, order lines
+    ORDER_DETAIL_BUDGET = 2  # order, order lines
+
+    def setUp(self):
+        User = get_user_model()
+        self.user = User.objects.create_user(email='testuser@example.com', password='testpassword')
+        self.client.force_authenticate(user=self.user)
+        self.menu_items = [
+            MenuItem.objects.create(name=f'Dish {i}', description='Dish', price=Decimal('5.00')) for i in range(3)
+        ]
+
+    def create_orders(self, count):
+        orders = Order.objects.bulk_create([
+            Order(user=self.user, total_price=Decimal('15.00'), delivery_time=timezone.now() + timedelta(hours=1),
+                  delivery_address='Test Address')
+            for _ in range(count)
+        ])
+        OrderItem.objects.bulk_create([
+            OrderItem(order=order, menu_item=menu_item, quantity=1)
+            for order in orders for menu_item in self.menu_items
+        ])
+        return orders
+
+    def test_order_list_query_budget(self):
+        for count in (1, 12):
+            Order.objects.all().delete()
+            self.create_orders(count)
+            with self.assertNumQueries(self.ORDER_LIST_BUDGET):
+                response = self.client.get('/api/order/list/')
+            self.assertEqual(len(response.data['results']), count)
+            self.assertEqual(len(response.data['results'][0]['items']), len(self.menu_items))
+
+    def test_order_detail_query_budget(self):
+        order = self.create_orders(1)[0]
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(f'/api/order/{order.id}/')
+        self.assertEqual(len(queries), self.ORDER_DETAIL_BUDGET)
+        self.assertFalse([query['sql'] for query in queries if 'restaurant_menuitem' in query['sql']])
+        self.assertEqual(sorted(item['menu_item'] for item in response.data['items']),
+                         [menu_item.id for menu_item in self.menu_items])
+
+
+class OrderCursorPaginationTests(APITestCase):
+
+    def setUp(self):
+        User = get_user_model()
+        self.user = User.objects.create_user(email='testuser@example.com', password='testpassword')
+        self.client.force_authenticate(user=self.user)
+        self.orders = Order.objects.bulk_create([
+            Order(user=self.user, total_price=Decimal('10.00'), delivery_time=timezone.now() + timedelta(hours=1),
+                  delivery_address=f'Address {i}')
+            for i in range(15)
+        ])
+
+    def collect(self, url):
+        ids = []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertNotIn('count', response.data)
+            ids.extend(order['id'] for order in response.data['results'])
+            url = response.data['next']
+        return ids
+
+    def test_cursor_pages_newest_first_without_count(self):
+        # orders and their lines only, no COUNT(*)
+        with self.assertNumQueries(2):
+            self.client.get('/api/order/list/?pagination=cursor')
+        ids = self.collect('/api/order/list/?pagination=cursor')
+        self.assertEqual(ids, sorted((order.id for order in self.orders), reverse=True))
+
+    def test_cursor_respects_ordering_and_filters(self):
+        Order.objects.filter(id__in=[order.id for order in self.orders[:5]]).update(is_delivered=True)
+        ids = self.collect('/api/order/list/?pagination=cursor&ordering=created_at&is_delivered=false')
+        self.assertEqual(ids, [order.id for order in self.orders[5:]])
+
+    def test_page_number_pagination_is_default(self):
+        response = self.client.get('/api/order/list/')
+        self.assertEqual(response.data['count'], len(self.orders))
+
+
+class OrderFilterIndexTests(TestCase):
+
+    def setUp(self):
+        User = get_user_model()
+        self.user = User.objects.create_user(email='testuser@example.com', password='testpassword')
+        Order.objects.bulk_create([
+            Order(user=self.user, total_price=Decimal('10.00'), delivery_time=timezone.now() + timedelta(hours=i),
+                  delivery_address='Test Address', is_delivered=i % 2 == 0)
+            for i in range(20)
+        ])
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE orders_order')
+            # the table is tiny, make the planner show which index it would pick on a big one
+            cursor.execute('SET LOCAL enable_seqscan = off')
+
+    def assertUsesIndex(self, queryset, *indexes):
+        plan = queryset.explain()
+        self.assertNotIn('Seq Scan', plan)
+        indexes = indexes or [index.name for index in Order._meta.indexes]
+        self.assertTrue(any(re.search(rf'(using|on) {index}\b', plan) for index in indexes), plan)
+
+    def test_every_filter_combination_uses_an_index(self):
+        delivery_times = (None, (timezone.now() + timedelta(hours=5)).isoformat())
+        delivered = (None, 'true', 'false')
+        orderings = (None, 'created_at', '-created_at')
+        for delivery_time, is_delivered, ordering in itertools.product(delivery_times, delivered, orderings):
+            data = {'delivery_time': delivery_time, 'is_delivered': is_delivered, 'ordering': ordering}
+            data = {key: value for key, value in data.items() if value is not None}
+            with self.subTest(**data):
+                filterset = OrderFilter(data, queryset=Order.objects.filter(user=self.user))
+                self.assertTrue(filterset.is_valid())
+                self.assertUsesIndex(filterset.qs)
+
+    def test_due_undelivered_sweep_uses_partial_index(self):
+        due = Order.objects.filter(is_delivered=False, delivery_time__lte=timezone.now() + timedelta(hours=3))
+        self.assertUsesIndex(due, 'order_undelivered_due_idx')
+
+
 class OrderDetailViewTests(APITestCase):
 
     def setUp(self):
@@ -148,4 +760,170 @@ class OrderDetailViewTests(APITestCase):
         self.client.logout()
         response = self.client.get(f'/api/order/{order_id}/')
 
-        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
\ No newline at end of file
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+
+class OrderExportTests(APITestCase):
+
+    def setUp(self):
+        User = get_user_model()
+        self.user = User.objects.create_user(email='testuser@example.com', password='testpassword')
+        self.staff = User.objects.create_user(email='staff@example.com', password='testpassword', is_staff=True)
+        self.menu_items = [
+            MenuItem.objects.create(name=f'Dish {i}', description='Dish', price=Decimal('5.00')) for i in range(2)
+        ]
+        self.orders = Order.objects.bulk_create([
+            Order(user=self.user, total_price=Decimal('10.00'), delivery_time=timezone.now() + timedelta(hours=1),
+                  delivery_address=f'Address {i}', is_delivered=i == 0)
+            for i in range(3)
+        ])
+        OrderItem.objects.bulk_create([
+            OrderItem(order=order, menu_item=menu_item, quantity=1, unit_price=Decimal('5.00'),
+                      line_total=Decimal('5.00'))
+            for order in self.orders for menu_item in self.menu_items
+        ])
+        self.client.force_authenticate(user=self.staff)
+
+    def export(self, query=''):
+        response = self.client.get(f'/api/order/export/{query}')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return b''.join(response.streaming_content).decode()
+
+    def test_export_requires_staff(self):
+        self.client.force_authenticate(user=self.user)
+        response = self.client.get('/api/order/export/')
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_ndjson_one_order_per_line(self):
+        records = [json.loads(line) for line in self.export().splitlines()]
+        self.assertEqual([record['id'] for record in records], [order.id for order in self.orders])
+        self.assertEqual(records[0]['delivery_address'], 'Address 0')
+        self.assertEqual([item['menu_item_id'] for item in records[0]['items']],
+                         [menu_item.id for menu_item in self.menu_items])
+        self.assertEqual(records[0]['items'][0]['line_total'], '5.00')
+
+    def test_csv_one_row_per_order_line(self):
+        rows = list(csv.reader(io.StringIO(self.export('?output=csv'))))
+        self.assertEqual(rows[0][:2], ['order_id', 'user_id'])
+        self.assertEqual(len(rows), 1 + len(self.orders) * len(self.menu_items))
+        self.assertEqual(rows[1][0], str(self.orders[0].id))
+
+    def test_export_applies_order_filter(self):
+        records = [json.loads(line) for line in self.export('?is_delivered=false').splitlines()]
+        self.assertEqual([record['id'] for record in records], [order.id for order in self.orders[1:]])
+
+    def test_unknown_output_is_rejected(self):
+        response = self.client.get('/api/order/export/?output=xml')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class ImportOrdersCommandTests(APITestCase):
+
+    def setUp(self):
+        User = get_user_model()
+        self.user = User.objects.create_user(email='testuser@example.com', password='testpassword')
+        self.menu_item = MenuItem.objects.create(name='Test Pizza', description='Pizza', price=Decimal('10.00'))
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+
+    def write(self, name, content):
+        path = os.path.join(self.directory.name, name)
+        with open(path, 'w') as file:
+            file.write(content)
+        return path
+
+    def records(self, count, **overrides):
+        return [dict({
+            'id': i, 'user_id': self.user.id, 'created_at': '2023-05-01T12:00:00+00:00',
+            'delivery_time': '2023-05-01T13:00:00+00:00', 'delivery_address': f'Address {i}',
+            'items': [{'menu_item_id': self.menu_item.id, 'quantity': 2, 'unit_price': '9.50'}],
+        }, **overrides) for i in range(count)]
+
+    def ndjson(self, records):
+        return self.write('orders.ndjson', ''.join(json.dumps(record) + '\n' for record in records))
+
+    def call(self, *args):
+        out, err = io.StringIO(), io.StringIO()
+        call_command('import_orders', *args, stdout=out, stderr=err)
+        return out.getvalue(), err.getvalue()
+
+    def test_imports_orders_and_lines(self):
+        self.call(self.ndjson(self.records(5)), '--chunk-size', '2')
+        self.assertEqual(Order.objects.count(), 5)
+        order = Order.objects.get(delivery_address='Address 3')
+        self.assertTrue(order.is_delivered)
+        self.assertEqual(order.total_price, Decimal('19.00'))
+        self.assertEqual(order.created_at.year, 2023)
+        line = order.orderitem_set.get()
+        self.assertEqual((line.quantity, line.unit_price, line.line_total), (2, Decimal('9.50'), Decimal('19.00')))
+        # ids come from the sequence, so regular order creation keeps working afterwards
+        self.assertGreater(Order.objects.create(user=self.user, total_price=1, delivery_time=timezone.now(),
+                                                delivery_address='New').id, order.id)
+
+    def test_unknown_menu_item_is_skipped(self):
+        records = self.records(3)
+        records[1]['items'][0]['menu_item_id'] = self.menu_item.id + 1000
+        out, err = self.call(self.ndjson(records))
+        self.assertIn('Unknown menu item id', err)
+        self.assertEqual(list(Order.objects.values_list('delivery_address', flat=True).order_by('id')),
+                         ['Address 0', 'Address 2'])
+        self.assertEqual(OrderImport.objects.get().skipped, 1)
+
+    def test_malformed_items_are_skipped(self):
+        records = self.records(4)
+        records[1]['items'] = [1]
+        records[2]['items'] = 'ab'
+        out, err = self.call(self.ndjson(records))
+        self.assertEqual(err.count('items must be a list of objects'), 2)
+        self.assertEqual(list(Order.objects.values_list('delivery_address', flat=True).order_by('id')),
+                         ['Address 0', 'Address 3'])
+
+    def test_values_the_columns_cannot_hold_are_skipped(self):
+        records = self.records(8)
+        records[1]['created_at'] = '2023-02-30T12:00:00+00:00'
+        records[2]['delivery_address'] = 'x' * 256
+        records[3]['items'][0]['quantity'] = 2 ** 31
+        records[4]['items'][0]['unit_price'] = 'NaN'
+        records[5]['items'][0]['unit_price'] = '100000000'
+        records[6]['items'][0]['quantity'] = 20000000
+        out, err = self.call(self.ndjson(records), '--chunk-size', '3')
+        self.assertIn('created_at must be an ISO 8601 datetime', err)
+        self.assertIn('delivery_address must be at most 255 characters', err)
+        self.assertIn('Item quantity must be between 1', err)
+        self.assertIn('unit_price must be a decimal number', err)
+        self.assertIn('unit_price must be at most', err)
+        self.assertIn('line_total must be at most', err)
+        self.assertEqual(list(Order.objects.values_list('delivery_address', flat=True).order_by('id')),
+                         ['Address 0', 'Address 7'])
+        self.assertEqual(OrderImport.objects.get().skipped, 6)
+
+    def test_resumes_after_crash(self):
+        path = self.ndjson(self.records(5))
+        load = OrderImporter.load
+        calls = itertools.count()
+
+        def crash_on_second_chunk(importer, *args, **kwargs):
+            if next(calls) == 1:
+                raise RuntimeError('worker killed')
+            return load(importer, *args, **kwargs)
+
+        with mock.patch.object(OrderImporter, 'load', crash_on_second_chunk), self.assertRaises(RuntimeError):
+            self.call(path, '--chunk-size', '2')
+        self.assertEqual(Order.objects.count(), 2)
+
+        out, _ = self.call(path, '--chunk-size', '2')
+        self.assertIn('Resuming', out)
+        self.assertEqual(sorted(Order.objects.values_list('delivery_address', flat=True)),
+                         [f'Address {i}' for i in range(5)])
+        out, _ = self.call(path)
+        self.assertIn('already imported', out)
+        self.assertEqual(Order.objects.count(), 5)
+
+    def test_imports_csv_export(self):
+        staff = get_user_model().objects.create_user(email='staff@example.com', password='pw', is_staff=True)
+        self.call(self.ndjson(self.records(3)))
+        self.client.force_authenticate(user=staff)
+        exported = b''.join(self.client.get('/api/order/export/?output=csv').streaming_content).decode()
+        self.call(self.write('orders.csv', exported))
+        self.assertEqual(Order.objects.count(), 6)
+        self.assertEqual(OrderItem.objects.filter(line_total=Decimal('19.00')).count(), 6)
@@ -1,15 +1,20 @@
 from rest_framework import status, permissions, generics
 from rest_framework.response import Response
-from .models import Order, OrderItem, Cart
-from restaurant.models import MenuItem
+from django.db.models import prefetch_related_objects
+from django.http import StreamingHttpResponse
+from .models import Order, order_items_prefetch
 from rest_framework.views import APIView
 from .serializers import OrderSerializer, CartSerializer, CreateOrderSerializer
-from drf_spectacular.utils import extend_schema
+from drf_spectacular.types import OpenApiTypes
+from drf_spectacular.utils import OpenApiParameter, extend_schema
 from rest_framework.permissions import IsAuthenticated
-from app.tasks import send_order_delivered_email
-from django.utils import timezone
 from django_filters.rest_framework import DjangoFilterBackend
+from .export import EXPORT_FORMATS, export_rows
 from .filters import OrderFilter
+from .cart_store import get_cart_store
+from .pagination import OrderCursorPagination
+from .mutations import CartConflict, CartMutation, CartMutationError
+from .services import checkout, CheckoutError
 from rest_framework.exceptions import NotAuthenticated
 
 
@@ -22,8 +27,8 @@ class CartView(APIView):
         responses={200: CartSerializer},
     )
     def get(self, request):
-        cart, _ = Cart.objects.get_or_create(user=request.user)
-        serializer = CartSerializer(cart)
+        cart = get_cart_store().get_cart(request.user)
+        serializer = CartSerializer(cart, context={'priced_cart': cart.priced()})
         return Response(serializer.data)
 
     @extend_schema(
@@ -46,23 +51,23 @@ class CartView(APIView):
         }
     )
     def post(self, request):
-        cart, _ = Cart.objects.get_or_create(user=request.user)
         items = request.data.get("items", {})
 
         if not isinstance(items, dict):
             return Response({"error": "Items must be a dictionary"}, status=status.HTTP_400_BAD_REQUEST)
 
-        invalid_items = []
-        for menu_item_id, quantity in items.items():
-            if not MenuItem.objects.filter(id=menu_item_id).exists():
-                invalid_items.append(menu_item_id)
-            else:
-                cart.add_item(menu_item_id, quantity)
+        try:
+            mutation = CartMutation(add=items)
+        except CartMutationError as exc:
+            return Response({"error": str(exc)}, status=status.HTTP_400_BAD_REQUEST)
 
+        invalid_items = mutation.invalid_items()
         if invalid_items:
             return Response({"error": f"Menu items not found: {invalid_items}"},
                             status=status.HTTP_400_BAD_REQUEST)
 
+        get_cart_store().apply(request.user, mutation)
+
         return Response({"status": "items added"}, status=status.HTTP_200_OK)
 
     @extend_schema(
@@ -84,20 +89,71 @@ class CartView(APIView):
         }
     )
     def put(self, request):
-        cart, _ = Cart.objects.get_or_create(user=request.user)
         items = request.data.get("items", {})
 
         if not isinstance(items, dict):
             return Response({"error": "Items must be a dictionary"}, status=status.HTTP_400_BAD_REQUEST)
 
-        for menu_item_id, quantity in items.items():
-            if quantity <= 0:
-                cart.remove_item(menu_item_id)
-            else:
-                cart.update_item_quantity(menu_item_id, quantity)
+        try:
+            mutation = CartMutation(update=items)
+        except CartMutationError as exc:
+            return Response({"error": str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+
+        get_cart_store().apply(request.user, mutation)
 
         return Response({"status": "cart updated"}, status=status.HTTP_200_OK)
 
+    @extend_schema(
+        summary="Apply a batch of cart changes",
+        description="Applies increments, quantity overwrites and removals in one atomic write and returns the "
+                    "new cart version. Concurrent increments are merged. Pass the cart `version` to make the "
+                    "write conditional; a stale version gets 409 with the current version.",
+        request={
+            "application/json": {
+                "example": {
+                    "version": 4,
+                    "add": {"1": 1},
+                    "update": {"3": 2},
+                    "remove": [5]
+                }
+            }
+        },
+        responses={
+            200: {"description": "Cart updated", "example": {"version": 5, "items": {"1": 3, "3": 2}}},
+            400: {"description": "Validation error", "example": {"error": "Add must be a dictionary"}},
+            409: {"description": "Version conflict", "example": {"error": "Cart version mismatch", "version": 6}}
+        }
+    )
+    def patch(self, request):
+        add = request.data.get("add", {})
+        update = request.data.get("update", {})
+        remove = request.data.get("remove", [])
+        version = request.data.get("version")
+
+        if not isinstance(add, dict) or not isinstance(update, dict):
+            return Response({"error": "Add and update must be dictionaries"}, status=status.HTTP_400_BAD_REQUEST)
+        if not isinstance(remove, list):
+            return Response({"error": "Remove must be a list"}, status=status.HTTP_400_BAD_REQUEST)
+        if version is not None and (isinstance(version, bool) or not isinstance(version, int)):
+            return Response({"error": "Version must be an integer"}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            mutation = CartMutation(add=add, update=update, remove=remove)
+        except CartMutationError as exc:
+            return Response({"error": str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+
+        invalid_items = mutation.invalid_items()
+        if invalid_items:
+            return Response({"error": f"Menu items not found: {invalid_items}"},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            version, items = get_cart_store().apply(request.user, mutation, version)
+        except CartConflict as exc:
+            return Response({"error": str(exc), "version": exc.version}, status=status.HTTP_409_CONFLICT)
+
+        return Response({"version": version, "items": items}, status=status.HTTP_200_OK)
+
     @extend_schema(
         summary="Remove items from cart",
         description="Removes specified items from the cart.",
@@ -114,14 +170,12 @@ class CartView(APIView):
         }
     )
     def delete(self, request):
-        cart, _ = Cart.objects.get_or_create(user=request.user)
         items = request.data.get("items", [])
 
         if not isinstance(items, list):
             return Response({"error": "Items must be a list"}, status=status.HTTP_400_BAD_REQUEST)
 
-        cart.items.clear()
-        cart.save()
+        get_cart_store().apply(request.user, CartMutation(remove=items))
 
         return Response({"status": "items removed"}, status=status.HTTP_200_OK)
 
@@ -136,34 +190,17 @@ class OrderView(APIView):
     )
     def post(self, request):
         """Create an order from the cart"""
-        cart, _ = Cart.objects.get_or_create(user=request.user)
-
-        if not cart.items:
-            return Response({"error": "Cart is empty"}, status=status.HTTP_400_BAD_REQUEST)
-
         serializer = CreateOrderSerializer(data=request.data)
         if not serializer.is_valid():
             return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
-        delivery_time = serializer.validated_data['delivery_time']
-        delivery_address = serializer.validated_data['delivery_address']
-        order = Order.objects.create(user=request.user, delivery_time=delivery_time, delivery_address=delivery_address,
-                                     total_price=cart.total_price())
-
-        for menu_item_id, quantity in cart.items.items():
-            menu_item = MenuItem.objects.get(id=menu_item_id)
-            OrderItem.objects.create(order=order, menu_item=menu_item, quantity=quantity)
-        if timezone.is_naive(delivery_time):
-            eta = timezone.make_aware(delivery_time)
-        else:
-            eta = delivery_time
-        send_order_delivered_email.apply_async(
-            args=[request.user.email, request.user.first_name, order.id],
-            eta=eta
-        )
-        cart.items.clear()
-        cart.save()
+        try:
+            order = checkout(request.user, serializer.validated_data['delivery_time'],
+                             serializer.validated_data['delivery_address'])
+        except CheckoutError as exc:
+            return Response({"error": str(exc)}, status=status.HTTP_400_BAD_REQUEST)
 
+        prefetch_related_objects([order], order_items_prefetch())
         order_serializer = OrderSerializer(order)
         return Response(order_serializer.data, status=status.HTTP_201_CREATED)
 
@@ -174,6 +211,24 @@ class OrderListView(generics.ListAPIView):
     filter_backends = (DjangoFilterBackend,)
     filterset_class = OrderFilter
 
+    @property
+    def paginator(self):
+        """Page numbers by default, keyset pagination with ``?pagination=cursor``."""
+        if not hasattr(self, '_paginator'):
+            if self.request.query_params.get('pagination') == 'cursor':
+                self._paginator = OrderCursorPagination()
+            else:
+                self._paginator = super().paginator
+        return self._paginator
+
+    @extend_schema(parameters=[
+        OpenApiParameter('pagination', str, enum=['cursor'],
+                         description="Use keyset pagination ordered by (created_at, id) instead of page numbers."),
+        OpenApiParameter('cursor', str, description="Cursor returned in `next`/`previous` in cursor mode."),
+    ])
+    def get(self, request, *args, **kwargs):
+        return super().get(request, *args, **kwargs)
+
     def get_queryset(self):
         if getattr(self, "swagger_fake_view", False):
             return Order.objects.none()
@@ -182,10 +237,41 @@ class OrderListView(generics.ListAPIView):
         if not user.is_authenticated:
             raise NotAuthenticated("User is not authenticated")
 
-        return Order.objects.filter(user=user)
+        return Order.objects.filter(user=user).with_items()
+
 
 class OrderDetailView(generics.RetrieveAPIView):
     permission_classes = [IsAuthenticated]
     serializer_class = OrderSerializer
-    queryset = Order.objects.all()
+    queryset = Order.objects.with_items()
     lookup_field = 'id'
+
+
+class OrderExportView(APIView):
+    permission_classes = [permissions.IsAdminUser]
+
+    @extend_schema(
+        summary="Export orders",
+        description="Streams every order matching the OrderFilter parameters together with its lines, as "
+                    "NDJSON (one order per line) or CSV (one order line per row).",
+        parameters=[
+            OpenApiParameter('output', str, enum=list(EXPORT_FORMATS), default='ndjson'),
+            OpenApiParameter('delivery_time', OpenApiTypes.DATETIME),
+            OpenApiParameter('is_delivered', bool),
+        ],
+        responses={(200, 'application/x-ndjson'): OpenApiTypes.STR, (200, 'text/csv'): OpenApiTypes.STR},
+    )
+    def get(self, request):
+        output = request.query_params.get('output', 'ndjson')
+        if output not in EXPORT_FORMATS:
+            return Response({"error": f"Output must be one of: {', '.join(EXPORT_FORMATS)}"},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        filterset = OrderFilter(request.query_params, queryset=Order.objects.all(), request=request)
+        if not filterset.is_valid():
+            return Response(filterset.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        stream, content_type = EXPORT_FORMATS[output]
+        response = StreamingHttpResponse(stream(export_rows(filterset.qs)), content_type=content_type)
+        response['Content-Disposition'] = f'attachment; filename="orders.{output}"'
+        return response
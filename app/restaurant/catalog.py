@@ -0,0 +1,144 @@
+import logging
+import threading
+import time
+from collections import namedtuple
+
+import redis
+from django.conf import settings
+from django.db import transaction
+from app.redis_client import get_redis
+from .models import MenuItem
+
+VERSION_KEY = 'menu:catalog:version'
+CHANNEL = 'menu:catalog'
+
+logger = logging.getLogger(__name__)
+
+CatalogItem = namedtuple('CatalogItem', ['name', 'price', 'available'])
+
+
+class CatalogSnapshot:
+    """Immutable ``{menu_item_id: CatalogItem}`` view of the menu at ``version``."""
+
+    def __init__(self, version, items, max_age=None):
+        self.version = version
+        self.items = items
+        self.max_age = settings.MENU_CATALOG_MAX_AGE if max_age is None else max_age
+        self.loaded_at = time.monotonic()
+
+    def __contains__(self, menu_item_id):
+        return menu_item_id in self.items
+
+    def __len__(self):
+        return len(self.items)
+
+    def get(self, menu_item_id):
+        return self.items.get(menu_item_id)
+
+
+class MenuCatalog:
+    """Process-local copy of the menu, reloaded with one query when it goes stale.
+
+    Every committed MenuItem change increments the version in Redis and publishes it on
+    ``CHANNEL``; a daemon thread drops the local snapshot when a newer version is announced.
+    ``MENU_CATALOG_MAX_AGE`` bounds staleness if a message is lost or a row is changed without
+    going through the ORM. While Redis is unreachable the menu is served from the database alone,
+    reloaded every ``MENU_CATALOG_FALLBACK_MAX_AGE`` seconds.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._snapshot = None
+        self._latest_version = 0
+        self._listener = None
+
+    def snapshot(self):
+        self._ensure_listener()
+        snapshot = self._snapshot
+        if not self._is_fresh(snapshot):
+            with self._lock:
+                snapshot = self._snapshot
+                if not self._is_fresh(snapshot):
+                    snapshot = self._snapshot = self._load()
+        return snapshot
+
+    def _is_fresh(self, snapshot):
+        return (snapshot is not None and snapshot.version >= self._latest_version
+                and time.monotonic() - snapshot.loaded_at < snapshot.max_age)
+
+    def _load(self):
+        # read the version first: a change committed during the query bumps it again afterwards
+        max_age = None
+        try:
+            version = self._version()
+        except redis.RedisError:
+            logger.warning("Menu catalog version unavailable, loading the menu from the database", exc_info=True)
+            version, max_age = self._latest_version, settings.MENU_CATALOG_FALLBACK_MAX_AGE
+        items = {
+            menu_item_id: CatalogItem(name, price, available)
+            for menu_item_id, name, price, available in MenuItem.objects.values_list('id', 'name', 'price', 'available')
+        }
+        return CatalogSnapshot(version, items, max_age)
+
+    def _version(self):
+        client = get_redis()
+        version = client.get(VERSION_KEY)
+        if version is None:
+            # the counter was lost (e.g. Redis restarted); restore it so versions never go backwards
+            client.set(VERSION_KEY, self._latest_version, nx=True)
+            version = client.get(VERSION_KEY)
+        return int(version)
+
+    def invalidate(self, version=None):
+        """Drop the local snapshot, or only a snapshot older than ``version``."""
+        if version is None:
+            self._snapshot = None
+        else:
+            self._latest_version = max(self._latest_version, version)
+
+    def changed(self):
+        """Record a MenuItem write: drop the local snapshot now and announce a new version on commit."""
+        self.invalidate()
+        transaction.on_commit(self.publish)
+
+    def publish(self):
+        """Announce a new version; on a Redis error other processes catch up within ``MENU_CATALOG_MAX_AGE``."""
+        try:
+            client = get_redis()
+            version = client.incr(VERSION_KEY)
+            if version <= self._latest_version:
+                version = client.incr(VERSION_KEY, self._latest_version + 1 - version)
+            self.invalidate(version)
+            client.publish(CHANNEL, version)
+        except redis.RedisError:
+            logger.exception("Could not announce the menu catalog change")
+            return None
+        return version
+
+    def _ensure_listener(self):
+        # checked with is_alive() so a process forked after the first use starts its own listener
+        if self._listener is None or not self._listener.is_alive():
+            with self._lock:
+                if self._listener is None or not self._listener.is_alive():
+                    self._listener = threading.Thread(target=self._listen, name='menu-catalog', daemon=True)
+                    self._listener.start()
+
+    def _listen(self):
+        while True:
+            try:
+                pubsub = get_redis().pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(CHANNEL)
+                # changes announced while we were not subscribed are lost
+                self.invalidate()
+                for message in pubsub.listen():
+                    if message['type'] == 'message':
+                        self.invalidate(int(message['data']))
+            except (redis.RedisError, ValueError):
+                time.sleep(1)
+
+
+catalog = MenuCatalog()
+
+
+def get_catalog():
+    return catalog.snapshot()
@@ -0,0 +1,33 @@
+import django_filters
+from django.contrib.postgres.search import SearchQuery, SearchRank, TrigramSimilarity
+from django.db.models import F, Q
+from django_filters.rest_framework import FilterSet
+from .models import SEARCH_CONFIG, MenuItem
+
+
+class MenuItemFilter(FilterSet):
+    search = django_filters.CharFilter(method='filter_search', label='Search name and description')
+    available = django_filters.BooleanFilter(field_name='available', label='Available')
+    min_price = django_filters.NumberFilter(field_name='price', lookup_expr='gte',
+                                            label='Price (Greater Than or Equal)')
+    max_price = django_filters.NumberFilter(field_name='price', lookup_expr='lte', label='Price (Less Than or Equal)')
+
+    class Meta:
+        model = MenuItem
+        fields = ['search', 'available', 'min_price', 'max_price']
+
+    def filter_search(self, queryset, name, value):
+        """Full-text match on name and description, or a fuzzy (trigram) match on the name, best first.
+
+        Both conditions are served by GIN indexes; the trigram match catches typos and partial
+        words the English stemmer does not.
+        """
+        value = value.strip()
+        if not value:
+            return queryset
+        query = SearchQuery(value, search_type='websearch', config=SEARCH_CONFIG)
+        return (
+            queryset.filter(Q(search_vector=query) | Q(name__trigram_similar=value))
+            .annotate(rank=SearchRank(F('search_vector'), query), similarity=TrigramSimilarity('name', value))
+            .order_by('-rank', '-similarity', 'id')
+        )
@@ -0,0 +1,124 @@
+import gzip
+import hashlib
+import re
+from urllib.parse import urlencode, urlsplit
+
+from django.conf import settings
+from django.core.cache import cache
+from django.test import RequestFactory
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.http import HttpResponse
+from rest_framework.renderers import JSONRenderer
+from app.redis_client import get_redis
+
+try:
+    import brotli
+except ImportError:  # optional; gzip is always available
+    brotli = None
+
+VARIANTS_KEY = 'menu:list:variants'
+CACHE_KEY_PREFIX = 'menu:list:'
+CACHEABLE_PARAMS = {'page'}
+ACCEPTS = {
+    'br': re.compile(r'\bbr\b'),
+    'gzip': re.compile(r'\bgzip\b'),
+}
+
+
+def variant(request):
+    """Return the cache variant for a menu list request, or None when it must be rendered normally.
+
+    Only anonymous JSON requests whose query string is limited to ``page`` are served pre-rendered,
+    and only for pages written the way pagination links write them, so spellings like ``page=01``
+    cannot grow the variant set. The scheme and host are part of the variant because pagination
+    links are absolute.
+    """
+    if request.user.is_authenticated or request.accepted_renderer.format != 'json':
+        return None
+    if not set(request.query_params) <= CACHEABLE_PARAMS:
+        return None
+    pages = request.query_params.getlist('page')
+    if pages and (len(pages) > 1 or not pages[0].isdigit() or str(int(pages[0])) != pages[0]):
+        return None
+    query = urlencode(sorted(request.query_params.items()))
+    return f'{request.scheme}://{request.get_host()}{request.path}?{query}'
+
+
+def _cache_key(variant):
+    return CACHE_KEY_PREFIX + hashlib.md5(variant.encode()).hexdigest()
+
+
+def _encode(body):
+    bodies = {'identity': body, 'gzip': gzip.compress(body, compresslevel=9)}
+    if brotli is not None:
+        bodies['br'] = brotli.compress(body)
+    return bodies
+
+
+def track(variant):
+    """Have later rebuilds re-render ``variant``."""
+    get_redis().sadd(VARIANTS_KEY, variant)
+
+
+def forget(variant):
+    cache.delete(_cache_key(variant))
+    get_redis().srem(VARIANTS_KEY, variant)
+
+
+def store(variant, response, replace=True):
+    """Render and compress a menu list ``response`` once and keep every encoding of it.
+
+    With ``replace=False`` an entry already there is kept: it was stored by a rebuild that may
+    have read the menu after ``response`` did.
+    """
+    entry = {
+        'bodies': _encode(JSONRenderer().render(response.data)),
+        'etag': response.get('ETag'),
+        'last_modified': response.get('Last-Modified'),
+    }
+    if replace:
+        cache.set(_cache_key(variant), entry, settings.MENU_CACHE_TIMEOUT)
+    else:
+        cache.add(_cache_key(variant), entry, settings.MENU_CACHE_TIMEOUT)
+    track(variant)
+
+
+def cached_response(request, variant):
+    """Serve ``variant`` from the cache, in the best encoding the client accepts, or return None."""
+    entry = cache.get(_cache_key(variant))
+    if entry is None:
+        return None
+    response = get_conditional_response(request, etag=entry['etag'])
+    if response is None:
+        accept_encoding = request.META.get('HTTP_ACCEPT_ENCODING', '')
+        encoding = next((name for name, pattern in ACCEPTS.items()
+                         if name in entry['bodies'] and pattern.search(accept_encoding)), 'identity')
+        response = HttpResponse(entry['bodies'][encoding], content_type='application/json')
+        if encoding != 'identity':
+            response['Content-Encoding'] = encoding
+        response['Content-Length'] = len(entry['bodies'][encoding])
+    for header, value in (('ETag', entry['etag']), ('Last-Modified', entry['last_modified'])):
+        if value:
+            response[header] = value
+    patch_vary_headers(response, ('Accept', 'Accept-Encoding'))
+    return response
+
+
+def rebuild():
+    """Re-render every variant served so far; variants that no longer exist (e.g. a page past the end) are dropped."""
+    from .views import MenuItemViewSet
+
+    view = MenuItemViewSet.as_view({'get': 'list'}, prerendered=False)
+    client = get_redis()
+    rebuilt = 0
+    for cached_variant in client.smembers(VARIANTS_KEY):
+        url = urlsplit(cached_variant)
+        request = RequestFactory().get(f'{url.path}?{url.query}', HTTP_HOST=url.netloc, HTTP_ACCEPT='application/json',
+                                       secure=url.scheme == 'https')
+        response = view(request)
+        if response.status_code == 200:
+            store(cached_variant, response)
+            rebuilt += 1
+        else:
+            forget(cached_variant)
+    return rebuilt
@@ -0,0 +1,35 @@
+# Generated by Django 5.1.5 on 2026-10-18 15:28
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.contrib.postgres.operations import AddIndexConcurrently, TrigramExtension
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    atomic = False
+
+    dependencies = [
+        ('restaurant', '0001_initial'),
+    ]
+
+    operations = [
+        TrigramExtension(),
+        migrations.AddField(
+            model_name='menuitem',
+            name='search_vector',
+            field=models.GeneratedField(db_persist=True, expression=django.contrib.postgres.search.CombinedSearchVector(django.contrib.postgres.search.SearchVector('name', config='english', weight='A'), '||', django.contrib.postgres.search.SearchVector('description', config='english', weight='B'), django.contrib.postgres.search.SearchConfig('english')), output_field=django.contrib.postgres.search.SearchVectorField()),
+        ),
+        AddIndexConcurrently(
+            model_name='menuitem',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['search_vector'], name='menuitem_search_vector_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='menuitem',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['name'], name='menuitem_name_trgm_idx', opclasses=['gin_trgm_ops']),
+        ),
+        AddIndexConcurrently(
+            model_name='menuitem',
+            index=models.Index(fields=['available', 'price'], name='menuitem_available_price_idx'),
+        ),
+    ]
@@ -1,5 +1,9 @@
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVector, SearchVectorField
 from django.db import models
 
+SEARCH_CONFIG = 'english'
+
 
 class MenuItem(models.Model):
     name = models.CharField(max_length=255)
@@ -8,7 +12,20 @@ class MenuItem(models.Model):
     available = models.BooleanField(default=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
+    # maintained by Postgres on every write; the name weighs more than the description in rankings
+    search_vector = models.GeneratedField(
+        expression=(SearchVector('name', weight='A', config=SEARCH_CONFIG)
+                    + SearchVector('description', weight='B', config=SEARCH_CONFIG)),
+        output_field=SearchVectorField(),
+        db_persist=True,
+    )
 
+    class Meta:
+        indexes = [
+            GinIndex(fields=['search_vector'], name='menuitem_search_vector_idx'),
+            GinIndex(fields=['name'], opclasses=['gin_trgm_ops'], name='menuitem_name_trgm_idx'),
+            models.Index(fields=['available', 'price'], name='menuitem_available_price_idx'),
+        ]
 
     def __str__(self):
         return self.name
@@ -7,3 +7,8 @@ class MenuItemSerializer(serializers.ModelSerializer):
         model = MenuItem
         fields = ('id', 'name', 'description', 'price', 'available', 'created_at', 'updated_at')
         read_only_fields = ('created_at', 'updated_at')
+
+
+class MenuItemBulkSerializer(MenuItemSerializer):
+    """A bulk upsert entry: with an ``id`` it replaces that item, without one it is created."""
+    id = serializers.IntegerField(required=False, min_value=1)
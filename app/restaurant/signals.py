@@ -0,0 +1,30 @@
+import logging
+
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from app.tasks import rebuild_menu_cache
+from .catalog import catalog
+from .models import MenuItem
+
+logger = logging.getLogger(__name__)
+
+
+def _enqueue_rebuild():
+    # runs after the write committed (inline in autocommit), so a broker outage must not fail the
+    # request; the entries expire after MENU_CACHE_TIMEOUT and the next write enqueues a rebuild
+    try:
+        rebuild_menu_cache.delay()
+    except Exception:
+        logger.exception("Could not enqueue the menu cache rebuild")
+
+
+def menu_changed():
+    """Invalidate the menu catalog and rebuild the pre-rendered menu once the change commits."""
+    catalog.changed()
+    transaction.on_commit(_enqueue_rebuild)
+
+
+@receiver([post_save, post_delete], sender=MenuItem)
+def menu_item_changed(sender, **kwargs):
+    menu_changed()
@@ -3,6 +3,21 @@ from rest_framework import status
 from .models import MenuItem
 from django.contrib.auth import get_user_model
 from decimal import Decimal
+import gzip
+import json
+import time
+from unittest import mock
+import redis
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
+from django.utils import timezone
+from app.tasks import rebuild_menu_cache
+from . import menu_cache
+from .filters import MenuItemFilter
+from .views import MenuItemViewSet
+from app.redis_client import get_redis
+from .catalog import CHANNEL, VERSION_KEY, CatalogItem, catalog, get_catalog
 
 class MenuItemSerializerTest(APITestCase):
     def setUp(self):
@@ -71,3 +86,316 @@ class MenuItemSerializerTest(APITestCase):
         }
         response = self.client.post('/api/restaurant/menu-items/', data, format='json')
         self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class MenuCatalogTests(APITestCase):
+
+    def setUp(self):
+        self.admin_user = get_user_model().objects.create_superuser(email='admin@example.com', password='password')
+        self.menu_item = MenuItem.objects.create(name='Pizza', description='Pizza', price=Decimal('10.00'))
+
+    def wait_for(self, condition):
+        deadline = time.monotonic() + 2
+        while not condition():
+            self.assertLess(time.monotonic(), deadline, 'catalog was not invalidated')
+            time.sleep(0.01)
+
+    def test_snapshot_serves_reads_without_queries(self):
+        get_catalog()
+        with self.assertNumQueries(0):
+            item = get_catalog().get(self.menu_item.id)
+        self.assertEqual(item, CatalogItem('Pizza', Decimal('10.00'), True))
+
+    def test_write_through_viewset_bumps_version(self):
+        version = get_catalog().version
+        self.client.force_authenticate(user=self.admin_user)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.patch(f'/api/restaurant/menu-items/{self.menu_item.id}/',
+                                         {'price': '12.50', 'available': False}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        snapshot = get_catalog()
+        self.assertGreater(snapshot.version, version)
+        self.assertEqual(snapshot.get(self.menu_item.id), CatalogItem('Pizza', Decimal('12.50'), False))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.delete(f'/api/restaurant/menu-items/{self.menu_item.id}/')
+        self.assertNotIn(self.menu_item.id, get_catalog())
+
+    def test_invalidation_from_another_process(self):
+        snapshot = get_catalog()
+        MenuItem.objects.filter(id=self.menu_item.id).update(price=Decimal('11.00'))
+        self.assertIs(get_catalog(), snapshot)
+
+        # what MenuCatalog.publish does in the process that made the change
+        client = get_redis()
+        client.publish(CHANNEL, client.incr(VERSION_KEY))
+        self.wait_for(lambda: get_catalog() is not snapshot)
+        self.assertEqual(get_catalog().get(self.menu_item.id).price, Decimal('11.00'))
+
+    def test_database_fallback_while_redis_is_down(self):
+        down = mock.Mock(**{f'{command}.side_effect': redis.ConnectionError for command in ('get', 'incr', 'pubsub')})
+        self.client.force_authenticate(user=self.admin_user)
+        with mock.patch('restaurant.catalog.get_redis', return_value=down):
+            with self.assertLogs('restaurant.catalog', 'ERROR'), self.captureOnCommitCallbacks(execute=True):
+                response = self.client.patch(f'/api/restaurant/menu-items/{self.menu_item.id}/',
+                                             {'price': '12.50'}, format='json')
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            with self.assertLogs('restaurant.catalog', 'WARNING'):
+                snapshot = get_catalog()
+        self.assertEqual(snapshot.get(self.menu_item.id).price, Decimal('12.50'))
+        self.assertEqual(snapshot.max_age, settings.MENU_CATALOG_FALLBACK_MAX_AGE)
+
+        catalog.invalidate()
+        self.assertEqual(get_catalog().max_age, settings.MENU_CATALOG_MAX_AGE)
+
+
+class MenuConditionalGetTests(APITestCase):
+
+    def setUp(self):
+        # authenticated, so the pre-rendered menu cache is bypassed
+        self.client.force_authenticate(user=get_user_model().objects.create_user(
+            email='user@example.com', password='password'))
+        self.menu_items = [
+            MenuItem.objects.create(name=f'Dish {i}', description='Dish', price=Decimal('5.00')) for i in range(3)
+        ]
+
+    def test_list_not_modified_without_loading_rows(self):
+        response = self.client.get('/api/restaurant/menu-items/')
+        etag = response['ETag']
+        self.assertTrue(response.has_header('Last-Modified'))
+
+        # only the max(updated_at)/count aggregate
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/restaurant/menu-items/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(response.content, b'')
+
+    def test_list_etag_changes_on_update_and_delete(self):
+        etag = self.client.get('/api/restaurant/menu-items/')['ETag']
+        self.menu_items[0].price = Decimal('6.00')
+        self.menu_items[0].save()
+        response = self.client.get('/api/restaurant/menu-items/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        # deleting an older item leaves max(updated_at) unchanged
+        etag = response['ETag']
+        last_modified = response['Last-Modified']
+        self.menu_items[1].delete()
+        response = self.client.get('/api/restaurant/menu-items/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data['results']), 2)
+        response = self.client.get('/api/restaurant/menu-items/', HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_retrieve_conditional(self):
+        url = f'/api/restaurant/menu-items/{self.menu_items[0].id}/'
+        response = self.client.get(url)
+        with self.assertNumQueries(1):
+            self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code,
+                             status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(self.client.get(url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified']).status_code,
+                         status.HTTP_304_NOT_MODIFIED)
+
+        self.menu_items[0].delete()
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code,
+                         status.HTTP_404_NOT_FOUND)
+        self.assertEqual(self.client.get('/api/restaurant/menu-items/abc/').status_code, status.HTTP_404_NOT_FOUND)
+
+
+class PrerenderedMenuTests(APITestCase):
+
+    def setUp(self):
+        cache.clear()
+        get_redis().delete(menu_cache.VARIANTS_KEY)
+        self.menu_items = [
+            MenuItem.objects.create(name=f'Dish {i}', description='Dish', price=Decimal('5.00')) for i in range(13)
+        ]
+
+    def test_anonymous_list_served_compressed_without_queries(self):
+        first = self.client.get('/api/restaurant/menu-items/')
+        self.assertEqual(first.status_code, status.HTTP_200_OK)
+
+        with self.assertNumQueries(0):
+            response = self.client.get('/api/restaurant/menu-items/', HTTP_ACCEPT_ENCODING='gzip, deflate')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', response['Vary'])
+        self.assertEqual(json.loads(gzip.decompress(response.content)), json.loads(first.content))
+        self.assertEqual(response['ETag'], first['ETag'])
+
+        with self.assertNumQueries(0):
+            response = self.client.get('/api/restaurant/menu-items/', HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_pages_are_cached_separately(self):
+        self.client.get('/api/restaurant/menu-items/')
+        self.client.get('/api/restaurant/menu-items/?page=2')
+        with self.assertNumQueries(0):
+            response = self.client.get('/api/restaurant/menu-items/?page=2')
+        self.assertEqual(len(json.loads(response.content)['results']), 1)
+
+    def test_only_canonical_existing_pages_are_cached(self):
+        for query in ('page=02', 'page=+2', 'page=x', 'page=2&page=2', 'page=3'):
+            self.client.get(f'/api/restaurant/menu-items/?{query}')
+        self.assertFalse(get_redis().smembers(menu_cache.VARIANTS_KEY))
+
+    def test_miss_does_not_replace_an_entry_stored_by_a_rebuild(self):
+        conditional = MenuItemViewSet.conditional
+
+        def rebuild_after_reading(view, *args, **kwargs):
+            response = conditional(view, *args, **kwargs)
+            if view.prerendered:
+                MenuItem.objects.filter(id=self.menu_items[0].id).update(
+                    price=Decimal('6.00'), updated_at=timezone.now())
+                menu_cache.rebuild()
+            return response
+
+        with mock.patch.object(MenuItemViewSet, 'conditional', rebuild_after_reading):
+            stale = self.client.get('/api/restaurant/menu-items/')
+        response = self.client.get('/api/restaurant/menu-items/')
+        self.assertNotEqual(response['ETag'], stale['ETag'])
+
+    def test_authenticated_and_filtered_requests_are_not_cached(self):
+        self.client.get('/api/restaurant/menu-items/?ordering=name')
+        self.assertFalse(get_redis().smembers(menu_cache.VARIANTS_KEY))
+
+        user = get_user_model().objects.create_user(email='user@example.com', password='password')
+        self.client.force_authenticate(user=user)
+        self.client.get('/api/restaurant/menu-items/')
+        self.assertFalse(get_redis().smembers(menu_cache.VARIANTS_KEY))
+
+    def test_rebuild_after_change(self):
+        self.client.get('/api/restaurant/menu-items/')
+        self.client.get('/api/restaurant/menu-items/?page=2')
+        with mock.patch('restaurant.signals.rebuild_menu_cache') as task, \
+                self.captureOnCommitCallbacks(execute=True):
+            MenuItem.objects.filter(id=self.menu_items[0].id).update(name='Renamed')
+            self.menu_items[12].delete()
+        task.delay.assert_called_once_with()
+
+        self.assertEqual(rebuild_menu_cache(), 1)
+        response = self.client.get('/api/restaurant/menu-items/')
+        self.assertIn('Renamed', [item['name'] for item in json.loads(response.content)['results']])
+        # the second page no longer exists
+        self.assertEqual(get_redis().smembers(menu_cache.VARIANTS_KEY),
+                         {'http://testserver/api/restaurant/menu-items/?'})
+
+    def test_broker_outage_does_not_fail_the_write(self):
+        with mock.patch('restaurant.signals.rebuild_menu_cache.delay', side_effect=OSError('broker down')), \
+                self.assertLogs('restaurant.signals', 'ERROR'), self.captureOnCommitCallbacks(execute=True):
+            self.menu_items[0].delete()
+        self.assertFalse(MenuItem.objects.filter(id=self.menu_items[0].id).exists())
+
+
+class MenuItemSearchTests(APITestCase):
+
+    def setUp(self):
+        MenuItem.objects.bulk_create([
+            MenuItem(name='Margherita Pizza', description='Tomato, mozzarella and basil', price=Decimal('10.00')),
+            MenuItem(name='Pepperoni Pizza', description='Spicy pepperoni', price=Decimal('12.00'), available=False),
+            MenuItem(name='Caesar Salad', description='Romaine with parmesan and croutons', price=Decimal('8.00')),
+            MenuItem(name='Tomato Soup', description='Roasted tomatoes', price=Decimal('6.00')),
+        ])
+
+    def names(self, query):
+        response = self.client.get(f'/api/restaurant/menu-items/?{query}')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [item['name'] for item in response.data['results']]
+
+    def test_full_text_search_ranks_name_above_description(self):
+        self.assertEqual(self.names('search=tomatoes'), ['Tomato Soup', 'Margherita Pizza'])
+        self.assertEqual(sorted(self.names('search=pizza')), ['Margherita Pizza', 'Pepperoni Pizza'])
+
+    def test_fuzzy_search_matches_typos(self):
+        self.assertEqual(self.names('search=ceasar salat'), ['Caesar Salad'])
+
+    def test_available_and_price_filters(self):
+        self.assertEqual(self.names('search=pizza&available=true'), ['Margherita Pizza'])
+        self.assertEqual(sorted(self.names('min_price=7&max_price=11')), ['Caesar Salad', 'Margherita Pizza'])
+
+    def test_filters_use_indexes(self):
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE restaurant_menuitem')
+            cursor.execute('SET LOCAL enable_seqscan = off')
+        cases = {
+            'menuitem_search_vector_idx': {'search': 'pizza'},
+            'menuitem_name_trgm_idx': {'search': 'piza'},
+            'menuitem_available_price_idx': {'available': 'true', 'min_price': '5', 'max_price': '9'},
+        }
+        for index, data in cases.items():
+            with self.subTest(**data):
+                plan = MenuItemFilter(data, queryset=MenuItem.objects.all()).qs.explain()
+                self.assertNotIn('Seq Scan', plan)
+                self.assertRegex(plan, rf'(using|on) {index}\b')
+
+
+class MenuItemBulkUpsertTests(APITestCase):
+
+    def setUp(self):
+        self.admin_user = get_user_model().objects.create_superuser(email='admin@example.com', password='password')
+        self.client.force_authenticate(user=self.admin_user)
+        self.menu_items = [
+            MenuItem.objects.create(name=f'Dish {i}', description='Dish', price=Decimal('5.00')) for i in range(3)
+        ]
+
+    def item(self, menu_item=None, **fields):
+        data = {'name': 'New Dish', 'description': 'Dish', 'price': '7.00'}
+        if menu_item:
+            data.update(id=menu_item.id, name=menu_item.name, description=menu_item.description)
+        return dict(data, **fields)
+
+    def test_requires_staff(self):
+        self.client.force_authenticate(user=None)
+        response = self.client.post('/api/restaurant/menu-items/bulk/', [self.item()], format='json')
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+        user = get_user_model().objects.create_user(email='user@example.com', password='password')
+        self.client.force_authenticate(user=user)
+        response = self.client.post('/api/restaurant/menu-items/bulk/', [self.item()], format='json')
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+        self.assertEqual(MenuItem.objects.count(), 3)
+
+    def test_upsert_with_one_invalidation(self):
+        created_at = self.menu_items[0].created_at
+        payload = [self.item(menu_item, price='9.50') for menu_item in self.menu_items] + [self.item()]
+        # id check, savepoint, upsert of updates, insert of new items, release, re-read
+        with mock.patch('restaurant.views.menu_changed') as menu_changed, self.assertNumQueries(6):
+            response = self.client.post('/api/restaurant/menu-items/bulk/', payload, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        menu_changed.assert_called_once_with()
+
+        self.assertEqual(len(response.data), 4)
+        self.assertEqual(MenuItem.objects.count(), 4)
+        self.assertEqual(MenuItem.objects.filter(price=Decimal('9.50')).count(), 3)
+        updated = MenuItem.objects.get(id=self.menu_items[0].id)
+        self.assertEqual(updated.created_at, created_at)
+        self.assertGreater(updated.updated_at, self.menu_items[0].updated_at)
+
+    def test_catalog_sees_batch_after_commit(self):
+        get_catalog()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post('/api/restaurant/menu-items/bulk/', [self.item(self.menu_items[0], price='3.00')],
+                             format='json')
+        self.assertEqual(get_catalog().get(self.menu_items[0].id).price, Decimal('3.00'))
+
+    def test_invalid_batch_writes_nothing(self):
+        payloads = [
+            [self.item(self.menu_items[0], price='1.00'), self.item(price='not a price')],
+            [self.item(self.menu_items[0], price='1.00'), self.item(id=self.menu_items[-1].id + 1000)],
+            [self.item(self.menu_items[0]), self.item(self.menu_items[0])],
+            [self.item(self.menu_items[0], price='1.00'), self.item(id='abc')],
+            [self.item(self.menu_items[0], price='1.00'), self.item(id=0)],
+            self.item(),
+        ]
+        for payload in payloads:
+            response = self.client.post('/api/restaurant/menu-items/bulk/', payload, format='json')
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(MenuItem.objects.filter(price=Decimal('1.00')).exists())
+        self.assertEqual(MenuItem.objects.count(), 3)
+
+    def test_numeric_string_ids_update_existing_items(self):
+        response = self.client.post('/api/restaurant/menu-items/bulk/',
+                                    [self.item(self.menu_items[0], id=str(self.menu_items[0].id), price='2.00')],
+                                    format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(MenuItem.objects.get(id=self.menu_items[0].id).price, Decimal('2.00'))
+        self.assertEqual(MenuItem.objects.count(), 3)
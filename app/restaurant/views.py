@@ -1,10 +1,118 @@
+import hashlib
+from functools import partial
+
+from django.db.models import Count, Max
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+from django.db import transaction
+from drf_spectacular.utils import extend_schema
 from rest_framework import viewsets
-from rest_framework import permissions
+from rest_framework import permissions, status
+from rest_framework.decorators import action
+from rest_framework.response import Response
+from . import menu_cache
+from .filters import MenuItemFilter
 from .models import MenuItem
-from .serializers import MenuItemSerializer
+from .serializers import MenuItemBulkSerializer, MenuItemSerializer
+from .signals import menu_changed
 
 
 class MenuItemViewSet(viewsets.ModelViewSet):
     queryset = MenuItem.objects.all()
     serializer_class = MenuItemSerializer
     permission_classes = [permissions.AllowAny]
+    filterset_class = MenuItemFilter
+    # anonymous list requests are answered from restaurant.menu_cache; the rebuild task renders with False
+    prerendered = True
+
+    def get_validators(self, queryset):
+        """Return ``(etag, last_modified)`` for ``queryset`` from one aggregate query, without loading rows.
+
+        The row count is part of the ETag so deleting an item changes it even though
+        ``max(updated_at)`` does not move.
+        """
+        state = queryset.aggregate(last_modified=Max('updated_at'), count=Count('id'))
+        if not state['count']:
+            return None, None
+        fingerprint = f"{state['last_modified'].isoformat()}:{state['count']}:{self.request.accepted_renderer.format}"
+        return quote_etag(hashlib.md5(fingerprint.encode()).hexdigest()), state['last_modified']
+
+    def conditional(self, request, queryset, respond, use_last_modified):
+        etag, last_modified = self.get_validators(queryset)
+        if etag is None:
+            return respond()
+        timestamp = int(last_modified.timestamp())
+        response = get_conditional_response(request, etag=etag,
+                                            last_modified=timestamp if use_last_modified else None)
+        if response is None:
+            response = respond()
+        if response.status_code in (200, 304):
+            response['ETag'] = etag
+            response['Last-Modified'] = http_date(timestamp)
+        return response
+
+    def list(self, request, *args, **kwargs):
+        variant = menu_cache.variant(request) if self.prerendered else None
+        if variant:
+            response = menu_cache.cached_response(request, variant)
+            if response is not None:
+                return response
+            # tracked before the menu is read, so a rebuild for a change committed meanwhile renders it too
+            menu_cache.track(variant)
+
+        # If-Modified-Since is not honoured here: a deletion leaves max(updated_at) unchanged
+        try:
+            response = self.conditional(request, self.filter_queryset(self.get_queryset()),
+                                        partial(super().list, request, *args, **kwargs), use_last_modified=False)
+        except Exception:
+            # e.g. a page past the end
+            if variant:
+                menu_cache.forget(variant)
+            raise
+        if variant and response.status_code == 200:
+            menu_cache.store(variant, response, replace=False)
+        elif variant and response.status_code != 304:
+            menu_cache.forget(variant)
+        return response
+
+    def retrieve(self, request, *args, **kwargs):
+        respond = partial(super().retrieve, request, *args, **kwargs)
+        try:
+            queryset = self.filter_queryset(self.get_queryset()).filter(
+                pk=int(kwargs[self.lookup_url_kwarg or self.lookup_field]))
+        except ValueError:
+            return respond()
+        return self.conditional(request, queryset, respond, use_last_modified=True)
+
+    @extend_schema(
+        summary="Create or update menu items in bulk",
+        description="Items with an `id` replace the existing item, items without one are created. "
+                    "The whole batch is validated first and written in a single upsert.",
+        request=MenuItemBulkSerializer(many=True),
+        responses=MenuItemSerializer(many=True),
+    )
+    @action(detail=False, methods=['post'], url_path='bulk', permission_classes=[permissions.IsAdminUser])
+    def bulk_upsert(self, request):
+        if not isinstance(request.data, list):
+            return Response({"error": "Expected a list of menu items"}, status=status.HTTP_400_BAD_REQUEST)
+        serializer = MenuItemBulkSerializer(data=request.data, many=True, context=self.get_serializer_context())
+        serializer.is_valid(raise_exception=True)
+
+        ids = [data.pop('id', None) for data in serializer.validated_data]
+        known = [menu_item_id for menu_item_id in ids if menu_item_id is not None]
+        if len(set(known)) != len(known):
+            return Response({"error": "Duplicate menu item ids"}, status=status.HTTP_400_BAD_REQUEST)
+        missing = set(known) - set(MenuItem.objects.filter(id__in=known).values_list('id', flat=True))
+        if missing:
+            return Response({"error": f"Menu items not found: {sorted(missing)}"}, status=status.HTTP_400_BAD_REQUEST)
+
+        menu_items = [MenuItem(id=menu_item_id, **data) for menu_item_id, data in zip(ids, serializer.validated_data)]
+        with transaction.atomic():
+            # bulk_create skips the model signals, so the menu caches are invalidated once for the batch
+            MenuItem.objects.bulk_create(
+                menu_items, update_conflicts=True, unique_fields=['id'],
+                update_fields=['name', 'description', 'price', 'available', 'updated_at'],
+            )
+            menu_changed()
+        saved = MenuItem.objects.filter(id__in=[menu_item.id for menu_item in menu_items]).order_by('id')
+        return Response(self.get_serializer(saved, many=True).data)
@@ -0,0 +1,99 @@
+import json
+import time
+
+from django.conf import settings
+from django.db import transaction
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.settings import api_settings
+from app.redis_client import get_redis
+from .models import CustomUser
+
+# the user fields carried as token claims and kept in the cached record
+CLAIM_FIELDS = ('email', 'first_name', 'is_staff', 'is_active')
+CLAIMS_AT_CLAIM = 'claims_at'
+
+
+def _record_key(user_id):
+    return f'user:{user_id}'
+
+
+def _changed_key(user_id):
+    return f'user:{user_id}:changed_at'
+
+
+def _now_ms():
+    return int(time.time() * 1000)
+
+
+def add_user_claims(token, user):
+    """Copy the user fields into ``token``, stamped with the time they were read."""
+    for field in CLAIM_FIELDS:
+        token[field] = getattr(user, field)
+    token[CLAIMS_AT_CLAIM] = _now_ms()
+    return token
+
+
+def invalidate_user(user_id):
+    """Drop the cached record of ``user_id`` and distrust claims issued before now, once the change commits.
+
+    The marker lives as long as an access token; refreshing always re-reads the claims, so no
+    access token with older claims can outlive it.
+    """
+    def invalidate():
+        with get_redis().pipeline() as pipeline:
+            pipeline.set(_changed_key(user_id), _now_ms(),
+                         ex=int(api_settings.ACCESS_TOKEN_LIFETIME.total_seconds()))
+            pipeline.delete(_record_key(user_id))
+            pipeline.execute()
+
+    transaction.on_commit(invalidate)
+
+
+def lightweight_user(user_id, fields):
+    """Build a ``CustomUser`` holding only ``id`` and ``CLAIM_FIELDS``; other fields are deferred.
+
+    It can be used anywhere a user instance is expected (foreign keys, filters, permission
+    checks). Reading a deferred field loads it from the database.
+    """
+    values = dict(fields, id=user_id)
+    concrete = [field.attname for field in CustomUser._meta.concrete_fields if field.attname in values]
+    return CustomUser.from_db('default', concrete, [values[name] for name in concrete])
+
+
+class StatelessJWTAuthentication(JWTAuthentication):
+    """JWT authentication that does not load the user from the database on every request.
+
+    Tokens issued by ``ClaimsTokenObtainPairSerializer`` carry the user's claims, which are used
+    as is unless the user changed after they were issued. Otherwise the user comes from a record
+    cached in Redis for ``USER_CACHE_TTL`` seconds, loaded from the database on a miss. Inactive
+    users are rejected like in ``JWTAuthentication``.
+    """
+
+    def get_user(self, validated_token):
+        try:
+            user_id = int(validated_token[api_settings.USER_ID_CLAIM])
+        except (KeyError, TypeError, ValueError):
+            raise AuthenticationFailed("Token contained no recognizable user identification", code='token_not_valid')
+
+        user = self._get_user(user_id, validated_token)
+        if api_settings.CHECK_USER_IS_ACTIVE and not user.is_active:
+            raise AuthenticationFailed("User is inactive", code='user_inactive')
+        return user
+
+    def _get_user(self, user_id, validated_token):
+        changed_at, record = get_redis().mget(_changed_key(user_id), _record_key(user_id))
+        claims_at = validated_token.get(CLAIMS_AT_CLAIM)
+        # tokens issued before a claim was added lack it and go through the cached record
+        if (claims_at is not None and all(field in validated_token for field in CLAIM_FIELDS)
+                and (changed_at is None or int(changed_at) < claims_at)):
+            return lightweight_user(user_id, {field: validated_token[field] for field in CLAIM_FIELDS})
+
+        if record is not None:
+            return lightweight_user(user_id, json.loads(record))
+
+        fields = CustomUser.objects.filter(id=user_id).values(*CLAIM_FIELDS).first()
+        if fields is None:
+            raise AuthenticationFailed("User not found", code='user_not_found')
+        get_redis().set(_record_key(user_id), json.dumps(fields), ex=settings.USER_CACHE_TTL)
+        return lightweight_user(user_id, fields)
@@ -0,0 +1,185 @@
+import hashlib
+import math
+import threading
+import time
+
+import redis
+from django.conf import settings
+from django.utils import timezone
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken, OutstandingToken
+from app.redis_client import get_redis
+
+SET_KEY = 'jwt:blacklist'
+SEEDED_KEY = 'jwt:blacklist:seeded'
+CHANNEL = 'jwt:blacklist'
+SEED_BATCH_SIZE = 10000
+
+
+class BloomFilter:
+    """Fixed-size Bloom filter over strings: no false negatives, ``error_rate`` false positives at ``capacity``."""
+
+    def __init__(self, capacity, error_rate):
+        self.size = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hash_count = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, value):
+        digest = hashlib.blake2b(value.encode(), digest_size=16).digest()
+        first, second = int.from_bytes(digest[:8], 'little'), int.from_bytes(digest[8:], 'little') | 1
+        return [(first + i * second) % self.size for i in range(self.hash_count)]
+
+    def add(self, value):
+        for position in self._positions(value):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, value):
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(value))
+
+
+class TokenBlacklistCache:
+    """Answers "is this jti blacklisted?" mostly from memory.
+
+    A per-process Bloom filter rules out almost every token that is not blacklisted without any
+    I/O; the few maybes are settled by the Redis set ``SET_KEY``. The filter only learns new jtis
+    through pub/sub, so it is trusted only while the listener is subscribed and the filter was
+    built after that; until then every lookup goes to the set. Postgres stays the source of
+    truth: the Redis set is seeded from it when missing, and consulted only if Redis lost the set.
+    Blacklist writes add the jti to the set and announce it on ``CHANNEL`` so every process adds
+    it to its filter; the filter is rebuilt every ``TOKEN_BLACKLIST_BLOOM_MAX_AGE`` seconds, which
+    also forgets pruned tokens.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # (filter, number of the subscription it was built under), replaced as a whole
+        self._state = None
+        self._loading = None
+        self._loaded_at = 0
+        self._listener = None
+        self._subscriptions = 0
+        # number of the listener's current subscription, None while it is not subscribed
+        self._subscription = None
+
+    def _stale(self):
+        state = self._state
+        return (state is None
+                or time.monotonic() - self._loaded_at > settings.TOKEN_BLACKLIST_BLOOM_MAX_AGE
+                or (self._subscription is not None and state[1] != self._subscription))
+
+    def _filter(self):
+        """Return the Bloom filter, or None when it may be missing announcements."""
+        self._ensure_listener()
+        if self._stale():
+            with self._lock:
+                if self._stale():
+                    # a filter built after the subscription was confirmed misses no announcement
+                    subscription = self._subscription
+                    self._state, self._loaded_at = (self._load(), subscription), time.monotonic()
+        bloom, subscription = self._state
+        if subscription is None or subscription != self._subscription:
+            return None
+        return bloom
+
+    def _load(self):
+        client = get_redis()
+        if not client.exists(SEEDED_KEY):
+            self.seed()
+        bloom = BloomFilter(settings.TOKEN_BLACKLIST_BLOOM_CAPACITY, settings.TOKEN_BLACKLIST_BLOOM_ERROR_RATE)
+        # announcements made while the set is scanned go into the new filter too
+        self._loading = bloom
+        try:
+            for jti in client.sscan_iter(SET_KEY, count=SEED_BATCH_SIZE):
+                bloom.add(jti)
+        finally:
+            self._loading = None
+        return bloom
+
+    def seed(self):
+        """Copy the jtis of unexpired blacklisted tokens from Postgres into the Redis set."""
+        client = get_redis()
+        jtis = (
+            BlacklistedToken.objects.filter(token__expires_at__gt=timezone.now())
+            .values_list('token__jti', flat=True).iterator(chunk_size=SEED_BATCH_SIZE)
+        )
+        batch = []
+        for jti in jtis:
+            batch.append(jti)
+            if len(batch) == SEED_BATCH_SIZE:
+                client.sadd(SET_KEY, *batch)
+                batch = []
+        if batch:
+            client.sadd(SET_KEY, *batch)
+        client.set(SEEDED_KEY, 1)
+
+    def contains(self, jti):
+        bloom = self._filter()
+        if bloom is not None and jti not in bloom:
+            return False
+        with get_redis().pipeline() as pipeline:
+            pipeline.sismember(SET_KEY, jti)
+            pipeline.exists(SEEDED_KEY)
+            member, seeded = pipeline.execute()
+        if member:
+            return True
+        if seeded:
+            return False
+        # Redis lost the set since this process built its filter
+        return BlacklistedToken.objects.filter(token__jti=jti).exists()
+
+    def add(self, jti):
+        client = get_redis()
+        client.sadd(SET_KEY, jti)
+        client.publish(CHANNEL, jti)
+        state = self._state
+        if state is not None:
+            state[0].add(jti)
+
+    def discard(self, jtis):
+        if jtis:
+            get_redis().srem(SET_KEY, *jtis)
+
+    def _ensure_listener(self):
+        if self._listener is None or not self._listener.is_alive():
+            with self._lock:
+                if self._listener is None or not self._listener.is_alive():
+                    self._subscription = None
+                    self._listener = threading.Thread(target=self._listen, name='jwt-blacklist', daemon=True)
+                    self._listener.start()
+
+    def _listen(self):
+        while True:
+            try:
+                pubsub = get_redis().pubsub()
+                pubsub.subscribe(CHANNEL)
+                for message in pubsub.listen():
+                    if message['type'] == 'subscribe':
+                        # announcements made while we were not subscribed are lost; _filter rebuilds
+                        self._subscriptions += 1
+                        self._subscription = self._subscriptions
+                    elif message['type'] == 'message':
+                        state = self._state
+                        for bloom in (state and state[0], self._loading):
+                            if bloom is not None:
+                                bloom.add(message['data'])
+            except redis.RedisError:
+                self._subscription = None
+                time.sleep(1)
+
+
+blacklist_cache = TokenBlacklistCache()
+
+
+def prune_expired_tokens(batch_size):
+    """Delete expired outstanding tokens (and with them their blacklist entries) in chunks of ``batch_size``."""
+    deleted = 0
+    while True:
+        chunk = list(
+            OutstandingToken.objects.filter(expires_at__lt=timezone.now())
+            .order_by('id').values_list('id', 'jti')[:batch_size]
+        )
+        if not chunk:
+            return deleted
+        ids, jtis = zip(*chunk)
+        OutstandingToken.objects.filter(id__in=ids).delete()
+        blacklist_cache.discard(jtis)
+        deleted += len(ids)
@@ -0,0 +1,14 @@
+import django_filters
+from django_filters.rest_framework import FilterSet
+from .models import CustomUser
+
+
+class UserFilter(FilterSet):
+    # served by customuser_email_prefix_idx and customuser_phone_trgm_idx
+    email = django_filters.CharFilter(field_name='email', lookup_expr='istartswith', label='Email starts with')
+    phone_number = django_filters.CharFilter(field_name='phone_number', lookup_expr='contains',
+                                             label='Phone number contains')
+
+    class Meta:
+        model = CustomUser
+        fields = ['email', 'phone_number']
@@ -0,0 +1,27 @@
+# Generated by Django 5.1.5 on 2026-10-18 15:44
+
+import django.contrib.postgres.indexes
+import django.db.models.functions.text
+from django.contrib.postgres.operations import AddIndexConcurrently, TrigramExtension
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    atomic = False
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('users', '0001_initial'),
+    ]
+
+    operations = [
+        TrigramExtension(),
+        AddIndexConcurrently(
+            model_name='customuser',
+            index=models.Index(django.contrib.postgres.indexes.OpClass(django.db.models.functions.text.Upper('email'), name='text_pattern_ops'), name='customuser_email_prefix_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='customuser',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['phone_number'], name='customuser_phone_trgm_idx', opclasses=['gin_trgm_ops']),
+        ),
+    ]
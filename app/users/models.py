@@ -1,4 +1,6 @@
+from django.contrib.postgres.indexes import GinIndex, OpClass
 from django.db import models
+from django.db.models.functions import Upper
 from django.contrib.auth.base_user import AbstractBaseUser
 from django.contrib.auth.models import PermissionsMixin
 from .managers import CustomUserManager
@@ -10,6 +12,14 @@ class CustomUser(AbstractBaseUser, PermissionsMixin):
     USERNAME_FIELD = "email"
     is_superuser = models.BooleanField(default=False)
     is_staff = models.BooleanField(default=False)
+    is_active = models.BooleanField(default=True)
     first_name = models.CharField(max_length=255, null=True)
     last_name = models.CharField(max_length=255, null=True)
     phone_number = models.CharField(max_length=13)
+
+    class Meta:
+        indexes = [
+            # email prefix search (istartswith compares UPPER(email) with LIKE 'X%')
+            models.Index(OpClass(Upper('email'), name='text_pattern_ops'), name='customuser_email_prefix_idx'),
+            GinIndex(fields=['phone_number'], opclasses=['gin_trgm_ops'], name='customuser_phone_trgm_idx'),
+        ]
@@ -0,0 +1,49 @@
+from django.db import connection
+from rest_framework.pagination import CursorPagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+
+RELTUPLES_SQL = "SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass"
+
+
+def estimated_count(queryset):
+    """Approximate ``queryset.count()`` without scanning.
+
+    An unfiltered queryset uses the row count Postgres keeps in ``pg_class.reltuples``; a filtered
+    one, or a table that was never analyzed, uses the planner's row estimate for the query.
+    """
+    with connection.cursor() as cursor:
+        if not queryset.query.where:
+            cursor.execute(RELTUPLES_SQL, [connection.ops.quote_name(queryset.model._meta.db_table)])
+            estimate = cursor.fetchone()[0]
+            if estimate >= 0:
+                return estimate
+        sql, params = queryset.order_by().query.sql_with_params()
+        cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}', params)
+        return cursor.fetchone()[0][0]['Plan']['Plan Rows']
+
+
+class UserKeysetPagination(CursorPagination):
+    """Keyset pagination by ``id`` with an approximate ``count``; no ``COUNT(*)`` is run."""
+    page_size = int(api_settings.PAGE_SIZE)
+    ordering = ('id',)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.count = estimated_count(queryset)
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        return Response({
+            'count': self.count,
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        response_schema = super().get_paginated_response_schema(schema)
+        response_schema['properties'] = {
+            'count': {'type': 'integer', 'description': "Approximate number of matching users."},
+            **response_schema['properties'],
+        }
+        return response_schema
@@ -1,5 +1,11 @@
 from rest_framework import serializers
+from rest_framework_simplejwt.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.serializers import (TokenBlacklistSerializer, TokenObtainPairSerializer,
+                                                  TokenRefreshSerializer)
+from rest_framework_simplejwt.settings import api_settings
+from .authentication import add_user_claims
 from .models import CustomUser
+from .tokens import RefreshToken
 import re
 
 
@@ -36,9 +42,36 @@ class UserUpdateSerializer(serializers.ModelSerializer):
         fields = ('first_name', 'last_name', 'phone_number')
 
     def update(self, instance, validated_data):
-        instance.first_name = validated_data.get('first_name', instance.first_name)
-        instance.last_name = validated_data.get('last_name', instance.last_name)
-        instance.phone_number = validated_data.get('phone_number', instance.phone_number)
-
-        instance.save()
+        # write only the columns that changed, so the row (and its password hash) is not rewritten
+        # and an unchanged profile does not invalidate the cached user
+        changed = [field for field, value in validated_data.items() if getattr(instance, field) != value]
+        for field in changed:
+            setattr(instance, field, validated_data[field])
+        if changed:
+            instance.save(update_fields=changed)
         return instance
+
+
+class ClaimsTokenObtainPairSerializer(TokenObtainPairSerializer):
+    """Issue tokens carrying the claims ``StatelessJWTAuthentication`` builds the user from."""
+    token_class = RefreshToken
+
+    @classmethod
+    def get_token(cls, user):
+        return add_user_claims(super().get_token(user), user)
+
+
+class ClaimsTokenRefreshSerializer(TokenRefreshSerializer):
+    """Re-read the claims on every refresh so changes reach the next access token."""
+    token_class = RefreshToken
+
+    def validate(self, attrs):
+        refresh = self.token_class(attrs['refresh'])
+        user = CustomUser.objects.filter(id=refresh.payload.get(api_settings.USER_ID_CLAIM)).first()
+        if user is None:
+            raise AuthenticationFailed(self.error_messages['no_active_account'], 'no_active_account')
+        return super().validate(dict(attrs, refresh=str(add_user_claims(refresh, user))))
+
+
+class CachedTokenBlacklistSerializer(TokenBlacklistSerializer):
+    token_class = RefreshToken
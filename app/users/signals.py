@@ -0,0 +1,24 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken
+from .authentication import CLAIM_FIELDS, invalidate_user
+from .blacklist import blacklist_cache
+from .models import CustomUser
+
+
+@receiver([post_save, post_delete], sender=CustomUser)
+def user_changed(sender, instance, created=False, update_fields=None, **kwargs):
+    # covers UserUpdateView, the admin and any other save; a new user has nothing cached yet, and a
+    # save limited to fields outside CLAIM_FIELDS leaves the cached record and the claims valid
+    if created or (update_fields is not None and not update_fields & set(CLAIM_FIELDS)):
+        return
+    invalidate_user(instance.pk)
+
+
+@receiver(post_save, sender=BlacklistedToken)
+def token_blacklisted(sender, instance, created=False, **kwargs):
+    # covers logout, refresh rotation and tokens blacklisted through the admin
+    if created:
+        jti = instance.token.jti
+        transaction.on_commit(lambda: blacklist_cache.add(jti))
@@ -1,6 +1,20 @@
 from rest_framework.test import APITestCase
 from rest_framework import status
+import time
+from datetime import timedelta
+from unittest import mock
+from django.conf import settings
 from django.contrib.auth import get_user_model
+from django.utils import timezone
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken, OutstandingToken
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from rest_framework_simplejwt.tokens import AccessToken
+from app.redis_client import get_redis
+from .authentication import StatelessJWTAuthentication
+from .blacklist import SEEDED_KEY, SET_KEY, BloomFilter, blacklist_cache, prune_expired_tokens
+from .throttling import HASHING_SLOTS_KEY
+from .tokens import RefreshToken
 
 
 class UserListViewTest(APITestCase):
@@ -26,6 +40,35 @@ class UserListViewTest(APITestCase):
         response = self.client.get('/api/user/')
         self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
 
+    def test_user_list_search(self):
+        get_user_model().objects.create_user(email='Userly@example.com', password='password',
+                                             phone_number='+380501112233')
+        self.client.force_authenticate(user=self.admin_user)
+        response = self.client.get('/api/user/', {'email': 'USER'})
+        self.assertEqual([user['email'] for user in response.data['results']],
+                         ['user@example.com', 'Userly@example.com'])
+        response = self.client.get('/api/user/', {'phone_number': '0501112'})
+        self.assertEqual([user['email'] for user in response.data['results']], ['Userly@example.com'])
+        self.assertIsInstance(response.data['count'], int)
+
+    def test_user_list_keyset_pages_with_estimated_count(self):
+        get_user_model().objects.bulk_create(
+            get_user_model()(email=f'bulk{i}@example.com', password='!') for i in range(20)
+        )
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE users_customuser')
+        self.client.force_authenticate(user=self.admin_user)
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/user/')
+        self.assertFalse([query['sql'] for query in queries if 'COUNT(' in query['sql'].upper()])
+        self.assertEqual(response.data['count'], 22)
+        ids = [user['id'] for user in response.data['results']]
+        response = self.client.get(response.data['next'])
+        ids += [user['id'] for user in response.data['results']]
+        self.assertIsNone(response.data['next'])
+        self.assertEqual(ids, sorted(get_user_model().objects.values_list('id', flat=True)))
+
 
 class UserCreateViewTest(APITestCase):
 
@@ -86,4 +129,268 @@ class UserUpdateViewTest(APITestCase):
             "phone_number": "+380992345678"
         }
         response = self.client.put('/api/user/update/', data, format='json')
-        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
\ No newline at end of file
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_user_update_writes_changed_columns_only(self):
+        get_redis().flushall()
+        self.client.force_authenticate(user=self.user)
+        with CaptureQueriesContext(connection) as queries, self.captureOnCommitCallbacks(execute=True):
+            response = self.client.patch('/api/user/update/', {'phone_number': '+380992345678'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        updates = [query['sql'] for query in queries if query['sql'].startswith('UPDATE')]
+        self.assertEqual(len(updates), 1)
+        self.assertIn('"phone_number"', updates[0])
+        self.assertNotIn('"password"', updates[0])
+        # phone_number is not cached with the user, so the claims stay valid
+        self.assertFalse(get_redis().exists(f'user:{self.user.pk}:changed_at'))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.patch('/api/user/update/', {'first_name': 'New'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(get_redis().exists(f'user:{self.user.pk}:changed_at'))
+
+    def test_user_update_without_changes_skips_write(self):
+        get_redis().flushall()
+        self.client.force_authenticate(user=self.user)
+        data = {'first_name': 'Old', 'last_name': 'Name', 'phone_number': '+380991234567'}
+        with CaptureQueriesContext(connection) as queries, self.captureOnCommitCallbacks(execute=True) as callbacks:
+            response = self.client.put('/api/user/update/', data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data, data)
+        self.assertFalse([query for query in queries if query['sql'].startswith('UPDATE')])
+        self.assertEqual(callbacks, [])
+
+
+class StatelessJWTAuthenticationTests(APITestCase):
+
+    def setUp(self):
+        get_redis().flushall()
+        self.user = get_user_model().objects.create_user(email='user@example.com', password='password',
+                                                         first_name='Test')
+
+    def login(self):
+        response = self.client.post('/api/user/login/', {'email': 'user@example.com', 'password': 'password'},
+                                    format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.data
+
+    def user_queries(self, access, url='/api/user/'):
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {access}')
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        return response.status_code, sum('"users_customuser"' in query['sql'] for query in queries)
+
+    def test_claims_authenticate_without_loading_the_user(self):
+        tokens = self.login()
+        self.assertEqual(AccessToken(tokens['access'])['first_name'], 'Test')
+        self.assertEqual(self.user_queries(tokens['access'], '/api/cart/'), (status.HTTP_200_OK, 0))
+        self.assertEqual(self.user_queries(tokens['access']), (status.HTTP_403_FORBIDDEN, 0))
+
+    def test_change_falls_back_to_cached_record(self):
+        access = self.login()['access']
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.is_staff = True
+            self.user.save()
+
+        # claims are stale: the user is loaded once, then served from the cache
+        self.assertEqual(self.user_queries(access, '/api/cart/'), (status.HTTP_200_OK, 1))
+        self.assertEqual(self.user_queries(access, '/api/cart/'), (status.HTTP_200_OK, 0))
+        self.assertEqual(self.user_queries(access)[0], status.HTTP_200_OK)
+
+    def test_user_update_invalidates(self):
+        access = self.login()['access']
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {access}')
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.patch('/api/user/update/', {'first_name': 'Renamed'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        user = StatelessJWTAuthentication().get_user(AccessToken(access))
+        self.assertEqual(user.first_name, 'Renamed')
+        self.assertEqual(user.pk, self.user.pk)
+
+    def test_deactivated_user_is_rejected(self):
+        tokens = self.login()
+        self.assertEqual(self.user_queries(tokens['access'], '/api/cart/')[0], status.HTTP_200_OK)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.is_active = False
+            self.user.save(update_fields=['is_active'])
+
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {tokens["access"]}')
+        for _ in range(2):  # from the database, then from the cached record
+            response = self.client.get('/api/cart/')
+            self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+            self.assertEqual(response.data['code'], 'user_inactive')
+        response = self.client.post('/api/user/login/refresh/', {'refresh': tokens['refresh']}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_refresh_reissues_claims(self):
+        refresh = self.login()['refresh']
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.first_name = 'Renamed'
+            self.user.save()
+        response = self.client.post('/api/user/login/refresh/', {'refresh': refresh}, format='json')
+        access = AccessToken(response.data['access'])
+        self.assertEqual(access['first_name'], 'Renamed')
+        self.assertEqual(self.user_queries(str(access), '/api/cart/'), (status.HTTP_200_OK, 0))
+
+    def test_token_without_claims_uses_cached_record(self):
+        access = str(AccessToken.for_user(self.user))
+        self.assertEqual(self.user_queries(access, '/api/cart/'), (status.HTTP_200_OK, 1))
+        self.assertEqual(self.user_queries(access, '/api/cart/'), (status.HTTP_200_OK, 0))
+
+
+class TokenBlacklistCacheTests(APITestCase):
+
+    def setUp(self):
+        get_redis().flushall()
+        blacklist_cache._state = None
+        self.user = get_user_model().objects.create_user(email='user@example.com', password='password')
+
+    def login(self):
+        return self.client.post('/api/user/login/', {'email': 'user@example.com', 'password': 'password'},
+                                format='json').data
+
+    def refresh(self, refresh):
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post('/api/user/login/refresh/', {'refresh': refresh}, format='json')
+
+    def test_bloom_filter_has_no_false_negatives(self):
+        bloom = BloomFilter(capacity=1000, error_rate=0.01)
+        members = [f'jti-{i}' for i in range(1000)]
+        for member in members:
+            bloom.add(member)
+        self.assertTrue(all(member in bloom for member in members))
+        false_positives = sum(f'other-{i}' in bloom for i in range(10000))
+        self.assertLess(false_positives, 300)
+
+    def test_filter_is_bypassed_until_listener_is_subscribed(self):
+        blacklist_cache.contains('warm-up')
+        deadline = time.monotonic() + 5
+        while blacklist_cache._filter() is None and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertIsNotNone(blacklist_cache._filter())
+
+        # blacklisted by another process whose announcement this one did not receive
+        get_redis().sadd(SET_KEY, 'rotated-elsewhere')
+        with mock.patch.object(blacklist_cache, '_subscription', None):
+            self.assertIsNone(blacklist_cache._filter())
+            self.assertTrue(blacklist_cache.contains('rotated-elsewhere'))
+            self.assertFalse(blacklist_cache.contains('never-blacklisted'))
+        # a new subscription rebuilds the filter from the set
+        with mock.patch.object(blacklist_cache, '_subscription', blacklist_cache._subscription + 1):
+            self.assertTrue(blacklist_cache.contains('rotated-elsewhere'))
+            self.assertIsNotNone(blacklist_cache._filter())
+
+    def test_unrevoked_token_check_skips_postgres(self):
+        refresh = self.login()['refresh']
+        blacklist_cache.contains('warm-up')
+        with self.assertNumQueries(0):
+            RefreshToken(refresh)
+
+    def test_rotated_and_logged_out_tokens_are_rejected(self):
+        refresh = self.login()['refresh']
+        rotated = self.refresh(refresh).data['refresh']
+        self.assertEqual(self.refresh(refresh).status_code, status.HTTP_401_UNAUTHORIZED)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/api/user/logout/', {'refresh': rotated}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(self.refresh(rotated).status_code, status.HTTP_401_UNAUTHORIZED)
+        self.assertEqual(len(get_redis().smembers(SET_KEY)), 2)
+
+    def test_token_blacklisted_through_the_admin_is_rejected(self):
+        refresh = self.login()['refresh']
+        outstanding = OutstandingToken.objects.get(jti=RefreshToken(refresh, verify=False)['jti'])
+        admin = get_user_model().objects.create_superuser(email='admin@example.com', password='password')
+        self.client.force_login(admin)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/api/admin/token_blacklist/blacklistedtoken/add/', {'token': outstanding.id})
+        self.assertEqual(response.status_code, status.HTTP_302_FOUND)
+        self.assertTrue(BlacklistedToken.objects.filter(token=outstanding).exists())
+        self.assertTrue(get_redis().sismember(SET_KEY, outstanding.jti))
+        self.client.logout()
+        self.assertEqual(self.refresh(refresh).status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_redis_loss_falls_back_to_postgres(self):
+        refresh = self.login()['refresh']
+        self.refresh(refresh)
+        get_redis().flushall()
+        self.assertEqual(self.refresh(refresh).status_code, status.HTTP_401_UNAUTHORIZED)
+
+        # a fresh filter reseeds the set from Postgres
+        blacklist_cache._state = None
+        self.assertTrue(blacklist_cache.contains(RefreshToken(refresh, verify=False)['jti']))
+        self.assertTrue(get_redis().exists(SEEDED_KEY))
+
+    def test_prune_expired_tokens_in_chunks(self):
+        expired = timezone.now() - timedelta(days=1)
+        tokens = OutstandingToken.objects.bulk_create([
+            OutstandingToken(user=self.user, jti=f'jti-{i}', token='token', expires_at=expired) for i in range(5)
+        ])
+        BlacklistedToken.objects.bulk_create([BlacklistedToken(token=token) for token in tokens[:3]])
+        get_redis().sadd(SET_KEY, 'jti-0', 'jti-1', 'jti-2')
+        live = RefreshToken.for_user(self.user)
+
+        self.assertEqual(prune_expired_tokens(batch_size=2), 5)
+        self.assertEqual(list(OutstandingToken.objects.values_list('jti', flat=True)), [live['jti']])
+        self.assertFalse(BlacklistedToken.objects.exists())
+        self.assertFalse(get_redis().smembers(SET_KEY))
+
+
+class AuthThrottleTests(APITestCase):
+
+    def setUp(self):
+        get_redis().flushall()
+        get_user_model().objects.create_user(email='user@example.com', password='password')
+
+    def login(self, email='user@example.com', **extra):
+        return self.client.post('/api/user/login/', {'email': email, 'password': 'password'}, format='json', **extra)
+
+    def test_email_window_slides(self):
+        with mock.patch('users.throttling.time.time', return_value=1000.0):
+            for _ in range(5):
+                self.assertEqual(self.login(REMOTE_ADDR='10.0.0.1').status_code, status.HTTP_200_OK)
+        with mock.patch('users.throttling.time.time', return_value=1030.0):
+            # another address does not help once the email is exhausted
+            response = self.login(email='USER@example.com', REMOTE_ADDR='10.0.0.2')
+            self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+            self.assertEqual(response['Retry-After'], '30')
+            self.assertEqual(self.login(email='other@example.com').status_code, status.HTTP_401_UNAUTHORIZED)
+        with mock.patch('users.throttling.time.time', return_value=1061.0):
+            self.assertEqual(self.login().status_code, status.HTTP_200_OK)
+
+    def test_ip_limit_covers_refresh(self):
+        for _ in range(20):
+            response = self.client.post('/api/user/login/refresh/', {'refresh': 'invalid'}, format='json')
+            self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+        response = self.client.post('/api/user/login/refresh/', {'refresh': 'invalid'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertEqual(self.login().status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertEqual(self.login(REMOTE_ADDR='10.0.0.1').status_code, status.HTTP_200_OK)
+
+    def test_spoofed_forwarded_for_shares_the_ip_window(self):
+        for i in range(20):
+            self.client.post('/api/user/login/refresh/', {'refresh': 'invalid'}, format='json',
+                             HTTP_X_FORWARDED_FOR=f'203.0.113.{i}')
+        response = self.client.post('/api/user/login/refresh/', {'refresh': 'invalid'}, format='json',
+                                    HTTP_X_FORWARDED_FOR='198.51.100.1')
+        self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+
+    def test_busy_hashing_slots_shed_load_before_hashing(self):
+        now = time.time()
+        get_redis().zadd(HASHING_SLOTS_KEY, {f'busy-{i}': now for i in range(settings.PASSWORD_HASHING_CONCURRENCY)})
+        with mock.patch('django.contrib.auth.hashers.PBKDF2PasswordHasher.encode') as encode:
+            response = self.client.post('/api/user/register/', {
+                'email': 'new@example.com', 'first_name': 'New', 'last_name': 'User',
+                'phone_number': '+380991234567', 'password': 'password123',
+            }, format='json')
+            self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+            self.assertEqual(response['Retry-After'], str(settings.PASSWORD_HASHING_RETRY_AFTER))
+            encode.assert_not_called()
+        self.assertEqual(get_redis().zcard(HASHING_SLOTS_KEY), settings.PASSWORD_HASHING_CONCURRENCY)
+
+    def test_abandoned_hashing_slots_are_reclaimed(self):
+        stale = time.time() - settings.PASSWORD_HASHING_SLOT_TIMEOUT - 1
+        get_redis().zadd(HASHING_SLOTS_KEY, {f'dead-{i}': stale for i in range(settings.PASSWORD_HASHING_CONCURRENCY)})
+        self.assertEqual(self.login().status_code, status.HTTP_200_OK)
+        self.assertEqual(get_redis().zcard(HASHING_SLOTS_KEY), 0)
@@ -0,0 +1,98 @@
+import math
+import time
+import uuid
+from contextlib import contextmanager
+
+from django.conf import settings
+from rest_framework.exceptions import Throttled
+from rest_framework.throttling import SimpleRateThrottle
+from app.redis_client import get_redis
+
+HASHING_SLOTS_KEY = 'throttle:password-hashing'
+
+
+class SlidingWindowThrottle(SimpleRateThrottle):
+    """Rate throttle over a true sliding window, shared by all workers through Redis.
+
+    Each key is a sorted set of request timestamps. A request is admitted when fewer than
+    ``num_requests`` timestamps fall in the last ``duration`` seconds; rejected requests are not
+    recorded, so a client that keeps retrying is let back in as soon as its window allows.
+    """
+    cache_format = 'throttle:%(scope)s:%(ident)s'
+
+    def allow_request(self, request, view):
+        if self.rate is None:
+            return True
+        self.key = self.get_cache_key(request, view)
+        if self.key is None:
+            return True
+
+        self.now = time.time()
+        member = f'{self.now}:{uuid.uuid4().hex}'
+        with get_redis().pipeline() as pipeline:
+            pipeline.zremrangebyscore(self.key, '-inf', self.now - self.duration)
+            pipeline.zadd(self.key, {member: self.now})
+            pipeline.zcard(self.key)
+            pipeline.zrange(self.key, 0, 0, withscores=True)
+            pipeline.expire(self.key, self.duration)
+            _, _, count, oldest, _ = pipeline.execute()
+        if count <= self.num_requests:
+            return True
+        get_redis().zrem(self.key, member)
+        self.oldest = oldest[0][1]
+        return False
+
+    def wait(self):
+        return max(0, self.oldest + self.duration - self.now)
+
+
+class AuthIPThrottle(SlidingWindowThrottle):
+    """Limits auth requests per client IP."""
+    scope = 'auth_ip'
+
+    def get_cache_key(self, request, view):
+        return self.cache_format % {'scope': self.scope, 'ident': self.get_ident(request)}
+
+
+class AuthEmailThrottle(SlidingWindowThrottle):
+    """Limits auth requests per submitted email, whichever IPs they come from."""
+    scope = 'auth_email'
+
+    def get_cache_key(self, request, view):
+        email = request.data.get('email') if hasattr(request.data, 'get') else None
+        if not isinstance(email, str) or not email.strip():
+            return None
+        return self.cache_format % {'scope': self.scope, 'ident': email.strip().lower()}
+
+
+@contextmanager
+def password_hashing_slot():
+    """Hold one of the ``PASSWORD_HASHING_CONCURRENCY`` slots shared by all workers, or raise ``Throttled``.
+
+    Slots are members of a Redis sorted set scored by when they were taken; a slot older than
+    ``PASSWORD_HASHING_SLOT_TIMEOUT`` seconds is treated as left behind by a dead worker.
+    """
+    client = get_redis()
+    slot = uuid.uuid4().hex
+    now = time.time()
+    with client.pipeline() as pipeline:
+        pipeline.zremrangebyscore(HASHING_SLOTS_KEY, '-inf', now - settings.PASSWORD_HASHING_SLOT_TIMEOUT)
+        pipeline.zadd(HASHING_SLOTS_KEY, {slot: now})
+        pipeline.zcard(HASHING_SLOTS_KEY)
+        pipeline.expire(HASHING_SLOTS_KEY, math.ceil(settings.PASSWORD_HASHING_SLOT_TIMEOUT))
+        _, _, taken, _ = pipeline.execute()
+    try:
+        if taken > settings.PASSWORD_HASHING_CONCURRENCY:
+            raise Throttled(wait=settings.PASSWORD_HASHING_RETRY_AFTER,
+                            detail="Too many sign-in attempts in progress, try again shortly.")
+        yield
+    finally:
+        client.zrem(HASHING_SLOTS_KEY, slot)
+
+
+class PasswordHashingLimitMixin:
+    """Runs POST inside ``password_hashing_slot``, after authentication, permissions and throttles."""
+
+    def post(self, request, *args, **kwargs):
+        with password_hashing_slot():
+            return super().post(request, *args, **kwargs)
@@ -0,0 +1,15 @@
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import RefreshToken as BaseRefreshToken
+from .blacklist import blacklist_cache
+
+
+class RefreshToken(BaseRefreshToken):
+    """Refresh token whose blacklist check goes through ``blacklist_cache`` instead of Postgres.
+
+    Blacklisting still writes ``BlacklistedToken``; ``users.signals`` adds the jti to the cache on commit.
+    """
+
+    def check_blacklist(self):
+        if blacklist_cache.contains(self.payload[api_settings.JTI_CLAIM]):
+            raise TokenError("Token is blacklisted")
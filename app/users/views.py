@@ -1,19 +1,34 @@
 from rest_framework import generics, permissions
+from rest_framework_simplejwt.views import TokenObtainPairView, TokenRefreshView
 
+from .filters import UserFilter
 from .models import CustomUser
+from .pagination import UserKeysetPagination
 from .serializers import UserCreateSerializer, UserSerializer, UserUpdateSerializer
+from .throttling import AuthEmailThrottle, AuthIPThrottle, PasswordHashingLimitMixin
+
+
+class LoginView(PasswordHashingLimitMixin, TokenObtainPairView):
+    throttle_classes = [AuthIPThrottle, AuthEmailThrottle]
+
+
+class LoginRefreshView(TokenRefreshView):
+    throttle_classes = [AuthIPThrottle]
 
 
 class UserListView(generics.ListAPIView):
     queryset = CustomUser.objects.all()
     serializer_class = UserSerializer
     permission_classes = [permissions.IsAdminUser]
+    filterset_class = UserFilter
+    pagination_class = UserKeysetPagination
 
 
-class UserCreateView(generics.CreateAPIView):
+class UserCreateView(PasswordHashingLimitMixin, generics.CreateAPIView):
     queryset = CustomUser.objects.all()
     serializer_class = UserCreateSerializer
     permission_classes = [permissions.AllowAny]
+    throttle_classes = [AuthIPThrottle, AuthEmailThrottle]
 
 
 class UserUpdateView(generics.RetrieveUpdateAPIView):
@@ -22,4 +37,5 @@ class UserUpdateView(generics.RetrieveUpdateAPIView):
     permission_classes = [permissions.IsAuthenticated]
 
     def get_object(self):
-        return self.request.user
+        # request.user may be a lightweight user built from token claims
+        return CustomUser.objects.get(pk=self.request.user.pk)